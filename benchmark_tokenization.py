@@ -0,0 +1,214 @@
+"""
+This module was made to measure the speed of the tokenization.
+It runs every method of ToTokenize on synthetic texts and reports
+characters per second, tokens per second, the number of memory blocks
+still allocated after a run (mostly the tokens it returned) and the peak
+memory. The results can be saved as a baseline and compared with it later,
+if they were measured on corpora of the same size and seed.
+
+Usage:
+    python benchmark_tokenization.py --size 200000 --save baseline.json
+    python benchmark_tokenization.py --size 200000 --compare baseline.json
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+from tokenizationworks import ToTokenize
+
+METHODS = ['tokenize', 'tokenize_with_generator', 'tokenize_with_types', 'tokenize_reduced']
+
+CYRILLIC = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюяАБВГДЕЖЗИКЛМНОПРСТУФХЦЧШЩЭЮЯ'
+LATIN = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+DIGITS = '0123456789'
+PUNCTUATION = ['.', ',', '!', '?', ';', ':', ' -', '...']
+
+
+def make_word(rng, alphabet, max_length=10):
+    """
+    This function creates a random word.
+    @param 'rng': an object of random.Random.
+    @param 'alphabet': the characters of the word.
+    @return: a word.
+    """
+    return ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, max_length)))
+
+
+def make_corpus(kind, size, seed=0):
+    """
+    This function creates a synthetic text.
+    @param 'kind': 'cyrillic', 'latin' or 'mixed'. A mixed text contains
+    Cyrillic and Latin words, numbers and words with digits like 'раму123'.
+    @param 'size': the number of characters in the text.
+    @param 'seed': the seed of the random generator, so the text is reproducible.
+    @return: the text.
+    """
+    rng = random.Random(seed)
+    words = []
+    length = 0
+    while length < size:
+        if kind == 'cyrillic':
+            word = make_word(rng, CYRILLIC)
+        elif kind == 'latin':
+            word = make_word(rng, LATIN)
+        elif kind == 'mixed':
+            choice = rng.random()
+            if choice < 0.4:
+                word = make_word(rng, CYRILLIC)
+            elif choice < 0.7:
+                word = make_word(rng, LATIN)
+            elif choice < 0.85:
+                word = make_word(rng, DIGITS, 6)
+            else:
+                word = make_word(rng, CYRILLIC, 6) + make_word(rng, DIGITS, 4)
+        else:
+            raise ValueError('Unknown corpus: %s' % kind)
+        if rng.random() < 0.15:
+            word += rng.choice(PUNCTUATION)
+        if rng.random() < 0.05:
+            word += '\n'
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+
+def run_method(tokenizer, method, text):
+    """
+    This function tokenizes the whole text with a method.
+    @return: the number of tokens.
+    """
+    return len(list(getattr(tokenizer, method)(text)))
+
+
+def measure(tokenizer, method, text, repeat):
+    """
+    This function measures one method on one text.
+    @param 'repeat': the number of runs. The fastest one is taken.
+    @return: a dictionary with the results.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens = run_method(tokenizer, method, text)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    # Memory is traced in a separate run because tracing slows the code down.
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = list(getattr(tokenizer, method)(text))
+    after = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # The blocks allocated by the run and not freed yet, not all the allocations.
+    live_blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    del result
+    return {'seconds': best,
+            'tokens': tokens,
+            'chars_per_sec': len(text) / best,
+            'tokens_per_sec': tokens / best,
+            'live_blocks': live_blocks,
+            'peak_bytes': peak}
+
+
+def run_benchmark(corpora, size, methods, repeat, seed=0):
+    """
+    This function measures every method on every corpus.
+    @return: a dictionary {corpus: {method: results}}.
+    """
+    tokenizer = ToTokenize()
+    results = {}
+    for kind in corpora:
+        text = make_corpus(kind, size, seed)
+        results[kind] = {}
+        for method in methods:
+            results[kind][method] = measure(tokenizer, method, text, repeat)
+    return results
+
+
+def print_results(results, baseline=None):
+    """
+    This function prints the results as a table. If a baseline is given,
+    the change of characters per second is printed too.
+    """
+    header = '%-10s %-24s %14s %14s %11s %12s' % (
+        'corpus', 'method', 'chars/sec', 'tokens/sec', 'live blocks', 'peak bytes')
+    if baseline is not None:
+        header += ' %9s' % 'change'
+    print(header)
+    for kind in results:
+        for method, result in results[kind].items():
+            line = '%-10s %-24s %14.0f %14.0f %11d %12d' % (
+                kind, method, result['chars_per_sec'], result['tokens_per_sec'],
+                result['live_blocks'], result['peak_bytes'])
+            if baseline is not None and method in baseline.get(kind, {}):
+                old = baseline[kind][method]['chars_per_sec']
+                line += ' %+8.1f%%' % ((result['chars_per_sec'] / old - 1) * 100)
+            print(line)
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    This function finds the methods that became slower than the baseline.
+    @param 'tolerance': the allowed slowdown, 0.1 means 10%.
+    @return: a list of (corpus, method, change) tuples.
+    """
+    regressions = []
+    for kind in results:
+        for method, result in results[kind].items():
+            if method not in baseline.get(kind, {}):
+                continue
+            change = result['chars_per_sec'] / baseline[kind][method]['chars_per_sec'] - 1
+            if change < -tolerance:
+                regressions.append((kind, method, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of ToTokenize.')
+    parser.add_argument('--size', type=int, default=100000,
+                        help='the number of characters in each corpus')
+    parser.add_argument('--corpus', action='append', choices=['cyrillic', 'latin', 'mixed'],
+                        help='a corpus to use, can be repeated (all by default)')
+    parser.add_argument('--method', action='append', choices=METHODS,
+                        help='a method to measure, can be repeated (all by default)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='the number of runs, the fastest one is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='save the results to a json file')
+    parser.add_argument('--compare', help='compare the results with a json file')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='the allowed slowdown when comparing, 0.1 means 10%%')
+    args = parser.parse_args(argv)
+
+    corpora = args.corpus or ['cyrillic', 'latin', 'mixed']
+    methods = args.method or METHODS
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            saved = json.load(baseline_file)
+        # The speed depends on the text, so only the same corpora can be compared.
+        if (saved.get('size'), saved.get('seed')) != (args.size, args.seed):
+            print('The baseline was measured with --size %s --seed %s, not --size %s --seed %s'
+                  % (saved.get('size'), saved.get('seed'), args.size, args.seed))
+            return 2
+        baseline = saved['results']
+    results = run_benchmark(corpora, args.size, methods, args.repeat, args.seed)
+    print_results(results, baseline)
+    if args.save:
+        with open(args.save, 'w') as result_file:
+            json.dump({'size': args.size, 'seed': args.seed, 'results': results}, result_file, indent=2)
+    if baseline is not None:
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for kind, method, change in regressions:
+            print('Regression: %s on %s is %.1f%% slower' % (method, kind, -change * 100))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,349 @@
+"""
+This module was made to search with boolean queries.
+A query consists of words, phrases in double quotes and parentheses
+joined by the operators AND, OR and NOT. Words that follow one another
+without an operator are joined by AND, and AND binds stronger than OR:
+    князь (андрей OR василий) NOT "анна павловна"
+A word with '*' (any characters) or '?' (one character) is a pattern that
+is replaced by the words of the database that match it, joined by OR.
+A question mark at the end of a word is not a wildcard, so an ordinary
+question like 'кто виноват?' is not a pattern.
+The query is parsed into a tree of nodes. Each node estimates how many
+files it can match, so AND evaluates its cheapest operands first and stops
+as soon as no file is left. The files are sets of ids stored as bitmaps.
+"""
+import re
+from tokenization import ToTokenize
+
+OPERATORS = ('AND', 'OR', 'NOT')
+
+# Parentheses, phrases in double quotes and everything else between spaces.
+LEXEM_PATTERN = re.compile(r'\(|\)|"[^"]*"|[^\s()"]+')
+# A word is a pattern if it has '*' next to a letter or '?' before a letter.
+MASK_PATTERN = re.compile(r'\w\*|\*\w|\?\w')
+# A query is boolean if it has an operator, a parenthesis or a pattern outside the phrases.
+BOOLEAN_PATTERN = re.compile(r'\b(?:AND|OR|NOT)\b|[()]|' + MASK_PATTERN.pattern)
+WILDCARD_PATTERN = re.compile(r'[*?]')
+PHRASE_PATTERN = re.compile(r'"[^"]*"')
+
+
+def is_boolean(query):
+    """
+    This function checks if a query uses the boolean operators, parentheses or patterns.
+    @param 'query': a query.
+    """
+    return BOOLEAN_PATTERN.search(PHRASE_PATTERN.sub(' ', query)) is not None
+
+
+class Evaluation:
+    """
+    The class gives the nodes the bitmaps of the words while a query is
+    evaluated. Every bitmap is read from the database only once, though
+    the nodes need it both to estimate their cost and to find their files.
+    """
+
+    def __init__(self, engine):
+        """
+        Start the evaluation of a query.
+        @param 'engine': an object of SearchEngine.
+        """
+        self.engine = engine
+        self.bitmaps = {}
+        self.documents = None
+
+    def get_bitmap(self, word):
+        """
+        This method gets the bitmap of the files a word is in.
+        """
+        bitmap = self.bitmaps.get(word)
+        if bitmap is None:
+            bitmap = self.bitmaps[word] = self.engine.get_bitmap(word)
+        return bitmap
+
+    def all_documents(self):
+        """
+        This method gets the bitmap of all the files.
+        """
+        if self.documents is None:
+            self.documents = self.engine.all_documents()
+        return self.documents
+
+    def count_documents(self):
+        """
+        This method gets the number of all the files.
+        """
+        return self.all_documents().bit_count()
+
+    def match_phrase(self, words, candidates):
+        """
+        This method finds the files of 'candidates' that contain a phrase.
+        """
+        return self.engine.match_phrase(words, candidates)
+
+
+class Term:
+    """
+    The node of a single word.
+    """
+
+    def __init__(self, word):
+        self.word = word
+
+    def __repr__(self):
+        return self.word
+
+    def estimate(self, engine):
+        """
+        This method estimates how many files the node can match.
+        @param 'engine': an object of Evaluation.
+        @return: the number of files.
+        """
+        return engine.get_bitmap(self.word).bit_count()
+
+    def evaluate(self, engine, candidates=-1):
+        """
+        This method finds the files the node matches.
+        @param 'engine': an object of Evaluation.
+        @param 'candidates': a bitmap of the only files that matter, the files
+        not in it may be left out of the result or not.
+        @return: a bitmap of the ids of the files.
+        """
+        return engine.get_bitmap(self.word)
+
+    def words(self):
+        """
+        This method gets the words whose positions are shown in the results.
+        A phrase is given as a tuple of its words, because only the places
+        where the whole phrase is found are shown.
+        """
+        return [self.word]
+
+
+class Phrase:
+    """
+    The node of words that must follow one another.
+    """
+
+    def __init__(self, words):
+        self.words_of_phrase = words
+
+    def __repr__(self):
+        return '"%s"' % ' '.join(self.words_of_phrase)
+
+    def estimate(self, engine):
+        # A phrase can't be in more files than its rarest word.
+        return min(engine.get_bitmap(word).bit_count() for word in set(self.words_of_phrase))
+
+    def evaluate(self, engine, candidates=-1):
+        # The positions are checked only in the candidates that contain all the words.
+        for word in set(self.words_of_phrase):
+            candidates &= engine.get_bitmap(word)
+            if not candidates:
+                return 0
+        return engine.match_phrase(self.words_of_phrase, candidates)
+
+    def words(self):
+        return [tuple(self.words_of_phrase)]
+
+
+class And:
+    """
+    The node of operands that must all match. The operands under NOT
+    are subtracted after the others.
+    """
+
+    def __init__(self, operands):
+        self.operands = operands
+
+    def __repr__(self):
+        return '(' + ' AND '.join(repr(operand) for operand in self.operands) + ')'
+
+    def estimate(self, engine):
+        positive = [operand for operand in self.operands if not isinstance(operand, Not)]
+        if not positive:
+            return engine.count_documents()
+        return min(operand.estimate(engine) for operand in positive)
+
+    def evaluate(self, engine, candidates=-1):
+        positive = [operand for operand in self.operands if not isinstance(operand, Not)]
+        negative = [operand.operand for operand in self.operands if isinstance(operand, Not)]
+        # The cheapest operands are evaluated first.
+        positive.sort(key=lambda operand: operand.estimate(engine))
+        negative.sort(key=lambda operand: -operand.estimate(engine))
+        if positive:
+            result = positive[0].evaluate(engine, candidates) & candidates
+            positive = positive[1:]
+        else:
+            result = engine.all_documents() & candidates
+        # The next operands matter only for the files that are left.
+        for operand in positive:
+            if not result:
+                return 0
+            result &= operand.evaluate(engine, result)
+        for operand in negative:
+            if not result:
+                return 0
+            result &= ~operand.evaluate(engine, result)
+        return result
+
+    def words(self):
+        words = []
+        for operand in self.operands:
+            words.extend(operand.words())
+        return words
+
+
+class Or:
+    """
+    The node of operands at least one of which must match.
+    """
+
+    def __init__(self, operands):
+        self.operands = operands
+
+    def __repr__(self):
+        return '(' + ' OR '.join(repr(operand) for operand in self.operands) + ')'
+
+    def estimate(self, engine):
+        return sum(operand.estimate(engine) for operand in self.operands)
+
+    def evaluate(self, engine, candidates=-1):
+        result = 0
+        for operand in self.operands:
+            result |= operand.evaluate(engine, candidates)
+        return result
+
+    def words(self):
+        words = []
+        for operand in self.operands:
+            words.extend(operand.words())
+        return words
+
+
+class Not:
+    """
+    The node of an operand that must not match.
+    """
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def __repr__(self):
+        return 'NOT ' + repr(self.operand)
+
+    def estimate(self, engine):
+        return engine.count_documents()
+
+    def evaluate(self, engine, candidates=-1):
+        return engine.all_documents() & ~self.operand.evaluate(engine, candidates)
+
+    def words(self):
+        # The words that are not in the files are not shown.
+        return []
+
+
+class QueryParser:
+    """
+    The class parses a boolean query into a tree of nodes.
+    """
+
+    def __init__(self, expand=None):
+        """
+        Create a parser.
+        @param 'expand': a function that gets the words of the database
+        that match a pattern. Without it the patterns are not allowed.
+        """
+        self.tokenizer = ToTokenize()
+        self.expand = expand
+
+    def parse(self, query):
+        """
+        This method parses a query.
+        @param 'query': a query.
+        @return: the root node of the tree.
+        """
+        if not isinstance(query, str):
+            raise TypeError
+        self.lexems = LEXEM_PATTERN.findall(query)
+        self.current = 0
+        node = self.parse_or()
+        if self.current < len(self.lexems):
+            raise ValueError('Unexpected %s in the query' % self.lexems[self.current])
+        return node
+
+    def peek(self):
+        """
+        This method gets the next lexem without taking it, or None at the end.
+        """
+        if self.current < len(self.lexems):
+            return self.lexems[self.current]
+        return None
+
+    def parse_or(self):
+        """
+        This method parses operands joined by OR.
+        """
+        operands = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.current += 1
+            operands.append(self.parse_and())
+        return operands[0] if len(operands) == 1 else Or(operands)
+
+    def parse_and(self):
+        """
+        This method parses operands joined by AND or following one another.
+        """
+        operands = [self.parse_not()]
+        while self.peek() is not None and self.peek() not in ('OR', ')'):
+            if self.peek() == 'AND':
+                self.current += 1
+            operands.append(self.parse_not())
+        # The operands of the nested AND are joined with this one.
+        flat = []
+        for operand in operands:
+            if isinstance(operand, And):
+                flat.extend(operand.operands)
+            else:
+                flat.append(operand)
+        return flat[0] if len(flat) == 1 else And(flat)
+
+    def parse_not(self):
+        """
+        This method parses an operand with or without NOT.
+        """
+        if self.peek() == 'NOT':
+            self.current += 1
+            return Not(self.parse_not())
+        return self.parse_primary()
+
+    def parse_primary(self):
+        """
+        This method parses a word, a pattern, a phrase or a query in parentheses.
+        """
+        lexem = self.peek()
+        if lexem is None or lexem in OPERATORS or lexem == ')':
+            raise ValueError('A word, a phrase or a parenthesis is expected in the query')
+        self.current += 1
+        if lexem == '(':
+            node = self.parse_or()
+            if self.peek() != ')':
+                raise ValueError('A closing parenthesis is missing in the query')
+            self.current += 1
+            return node
+        if lexem.startswith('"'):
+            words = [token.wordform for token in self.tokenizer.tokenize_reduced(lexem[1:-1])]
+            if not words:
+                raise ValueError('Empty phrase in the query')
+            return Phrase(words) if len(words) > 1 else Term(words[0])
+        if MASK_PATTERN.search(lexem):
+            if self.expand is None:
+                raise ValueError('The pattern %s can\'t be expanded' % lexem)
+            # The question marks at the end are the end of a question.
+            # No word matches the pattern if the list is empty.
+            words = self.expand(lexem.rstrip('?'))
+            return Term(words[0]) if len(words) == 1 else Or([Term(word) for word in words])
+        words = [token.wordform for token in self.tokenizer.tokenize_reduced(lexem)]
+        if not words:
+            raise ValueError('%s is not a word' % lexem)
+        # A lexem like 'что-нибудь' consists of several words, all of them must match.
+        return Term(words[0]) if len(words) == 1 else And([Term(word) for word in words])
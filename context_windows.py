@@ -1,10 +1,25 @@
 import shelve
 import os
-import re
+from bisect import bisect_left
+from bisect import bisect_right
+from itertools import islice
 from indexation import PositionByLine
+from indexation import find_sentence_ends
 from tokenization import ToTokenize
 from tokenization import TokenWithType
 from search_engine import SearchEngine
+from search_engine import position_key
+from document_store import DocumentStore
+
+# The approximate number of bytes a cached quote takes besides its text,
+# and the number of bytes a cached position takes.
+SNIPPET_SIZE = 200
+POSITION_SIZE = 40
+
+# The strings put before and after the words of the query by ContextWindow.make_bold().
+MARKUPS = {'html': ('<b>', '</b>'),
+           'ansi': ('\033[1m', '\033[0m'),
+           'plain': ('[', ']')}
 
 class ContextWindow:
     '''
@@ -13,9 +28,7 @@ class ContextWindow:
 
     def __init__(self, position, left_cont, right_cont, line):        
         """
-        Create an object of ContextWindow class. Attributes
-        self.start_pattern and self.end_pattern are needed to find 
-        the end and the beginning of the sentence in which a context window is situated.        
+        Create an object of ContextWindow class.
         @param 'position':  a position of the word in question;
         @param 'left_cont': the left context of the word in question;
         @param 'right_cont': the right context of the word in question;
@@ -25,8 +38,8 @@ class ContextWindow:
         self.position = position
         self.left_cont = left_cont
         self.right_cont = right_cont
-        self.end_pattern = re.compile(r'[.?!]\s[A-ZА-Я]?')
-        self.start_pattern = re.compile(r'[A-ZА-Я]*[.?!]')
+        # The window with the bold words, it is set by make_bold().
+        self.highlighted = None
         
     def __eq__(self, obj):
         """
@@ -42,66 +55,92 @@ class ContextWindow:
         return '(' + str(self.position) + ','+ str(self.left_cont) + ',' \
                + str(self.right_cont) + ',' + self.line + ')'
     
-    def make_bold(self):
+    def make_bold(self, markup='html'):
         '''
         This method makes inquired words bold.
+        The spans of the words are sorted and the overlapping ones are merged,
+        then the pieces of the window are joined once. The line of the window
+        is not changed, the result is also kept in self.highlighted.
+        @param 'markup': the name of the markup from MARKUPS or a pair
+        of the strings put before and after a word.
+        @return: the window with the bold words.
         '''
-        # A slice that is equal to the context window.
-        result_line = self.line[self.left_cont:self.right_cont]
-        # We make words bold by adding html tags starting from the end of the line.
-        # To do that we reverse the position of a word of the query
-        # so that the enlargement of the line doesn't change the positions of the words in question.
-        for pos in reversed(self.position):
-            # This is the beginning of the word in question.
-            start = pos.start - self.left_cont
-            # This is the end of the word in question.
-            end = pos.end - self.left_cont
-            # Change the last part of the slice.
-            result_line = result_line[:end] + '</b>' + result_line[end:]
-            # Change the first part of the slice.
-            result_line = result_line[:start] + '<b>' + result_line[start:]
-            self.line = result_line
-        return result_line
+        if isinstance(markup, str):
+            markup = MARKUPS[markup]
+        opening, closing = markup
+        # The spans of the words within the window, sorted by start.
+        spans = sorted((max(pos.start, self.left_cont), min(pos.end, self.right_cont))
+                       for pos in self.position)
+        pieces = []
+        # The end of the text that has already been added to the pieces.
+        done = self.left_cont
+        span_start = span_end = None
+        for start, end in spans:
+            if start >= end:
+                continue
+            # An overlapping span continues the current one.
+            if span_end is not None and start < span_end:
+                span_end = max(span_end, end)
+                continue
+            if span_end is not None:
+                pieces.extend((self.line[done:span_start], opening, self.line[span_start:span_end], closing))
+                done = span_end
+            span_start, span_end = start, end
+        if span_end is not None:
+            pieces.extend((self.line[done:span_start], opening, self.line[span_start:span_end], closing))
+            done = span_end
+        pieces.append(self.line[done:self.right_cont])
+        self.highlighted = ''.join(pieces)
+        return self.highlighted
     
-    def extend_to_sentence(self):
+    def extend_to_sentence(self, sentence_ends=None):
         '''
         This method extends a context window to the boundaries
-        of a sentence it is situated in.
+        of a sentence it is situated in. The window starts after the end
+        of the previous sentence and ends just after the end of its own sentence
+        or at the end of the line.
+        @param 'sentence_ends': the sorted offsets just after the end of each
+        sentence of the line, as recorded by ToIndex.index_by_line().
+        If they are not given, they are found in the line.
         '''
-        # For convenienve write substrings on the left and on the right
-        # of the window into single variables.
-        left_substr = self.line[:self.left_cont + 1]
-        right_substr = self.line[self.right_cont:]         
-        # Search a substring that matches our pattern on
-        # 'left_substr' and 'right_substr'.
-        # For convenience write the result to variables
-        # 'start' and 'end'.
-        start = re.search(self.start_pattern, left_substr)
-        end = re.search(self.end_pattern, right_substr)
-        # If there is a substring that matches our 'end_pattern'
-        # than we move the position of the right context to the
-        # first character of this substring.
-        if end is not None: 
-            self.right_cont = self.right_cont + end.start()
+        if sentence_ends is None:
+            sentence_ends = find_sentence_ends(self.line)
+        # The end of the previous sentence is the last end not after the left context.
+        i = bisect_right(sentence_ends, self.left_cont)
+        left_cont = sentence_ends[i - 1] if i > 0 else 0
+        # The sentence starts after the spaces that follow the previous one.
+        while left_cont < self.left_cont and self.line[left_cont].isspace():
+            left_cont += 1
+        self.left_cont = left_cont
+        # The end of the sentence is the first end not before the right context.
+        i = bisect_left(sentence_ends, self.right_cont)
+        if i < len(sentence_ends):
+            self.right_cont = sentence_ends[i]
         # Otherwise we move the position of the right context to the
         # end of the line in which the context window is situated.
         else:
             self.right_cont = len(self.line)
-        # If there is a substring that matches our 'start_pattern'
-        # than we move the position of the left context to the
-        # first character of this substring.
-        if start is not None:
-            self.left_cont = self.left_cont - start.start()
-        # Otherwise we move the position of the left context to the
-        # start of the line in which the context window is situated.
-        else:
-            self.left_cont = 0
             
             
 class Contexter:
     '''
     This class creates an object that provides a context window.
-    '''        
+    '''
+    def __init__(self, store=None, snippet_cache=None, markup='html'):
+        '''
+        Create an object of Contexter.
+        @param 'store': an object of DocumentStore that gets the lines
+        of the files. If it is not given, a store without a database is used.
+        @param 'snippet_cache': an object of LRUCache for the bold quotes.
+        If it is not given, the quotes are not cached.
+        @param 'markup': the markup of the bold words, see ContextWindow.make_bold().
+        '''
+        if store is None:
+            store = DocumentStore()
+        self.store = store
+        self.snippet_cache = snippet_cache
+        self.markup = markup
+
     def get_one_cw(self, window_size, file_path, p):        
         '''
         This method creates a context window for a one-word query.
@@ -123,46 +162,77 @@ class Contexter:
         position.append(p)
         # Create an object of ToTokenize().
         tokenizer = ToTokenize()
-        # Open a given file.
-        file = open(file_path, 'r')
-        # For convenience write position in these variables.
-        st = p.start
-        end = p.end
-        line_num = p.line        
-        # In the file find a line in which the word of the query is,
+        # Get the line in which the word of the query is,
         # and write it to 'line'.
-        for i, line in enumerate(file):
-            if i == line_num:
-                break
-        file.close()
-        # Write a tokenized substring into the variable 'right_tokens'
-        right_tokens = list(tokenizer.tokenize_reduced(line[st:]))
-        
-        # If the window_size is bigger than the right substring,
-        # than reduce the window size to the length of the substring.
-        if window_size > len(right_tokens)-1:
-            window_size = len(right_tokens)        
-        # For each token in enumerated 'right_tokens'.
-        for i, token in enumerate(right_tokens):            
-            if i == window_size:
-                break           
-        # Write end.
-        right_border =  st + token.start + len(token.wordform)      
-        # This is a left substring. We write it to 'left_sub_line'
-        # for our convenience.
-        left_tokens = list(tokenizer.tokenize_reduced(line[:end]))
-        if window_size > len(left_tokens):
-                window_size = len(left_tokens) 
-        # Tokenize the left sub line in reversed order until it is
-        # bigger than a context size and write the index
-        # of the end of the last one in 'left_border'.
-        for i, token in enumerate(left_tokens[::-1]):
-            if i == window_size:
-                break
-        left_border = token.start              
+        line = self.store.get_line(file_path, p.line)
+        # Tokenize the whole line.
+        tokens = list(tokenizer.tokenize_reduced(line))
+        starts = [token.start for token in tokens]
+        left_border, right_border = self.get_borders(window_size, tokens, starts, p)
         cw = ContextWindow(position, left_border, right_border, line)
         return cw
 
+    def get_borders(self, window_size, tokens, starts, p):
+        '''
+        This method finds the borders of a context window in a tokenized line.
+        @param 'window_size': window size.
+        @param 'tokens': alphabetical and digital tokens of the line.
+        @param 'starts': the starts of these tokens.
+        @param 'p': position of the word in question.
+        @return: the left and the right borders of the window.
+        '''
+        # This is the number of the token of the word in question.
+        k = bisect_left(starts, p.start)
+        # The number of tokens from the word in question to the end of the line.
+        right_size = len(tokens) - k
+        # If the window_size is bigger than the right part of the line,
+        # than reduce the window size to the length of this part.
+        if window_size > right_size - 1:
+            window_size = right_size
+        token = tokens[k + min(window_size, right_size - 1)]
+        right_border = token.start + len(token.wordform)
+        # The number of tokens from the beginning of the line
+        # to the word in question.
+        left_size = k + 1
+        if window_size > left_size:
+            window_size = left_size
+        left_border = tokens[k - min(window_size, left_size - 1)].start
+        return left_border, right_border
+
+    def get_file_cws(self, window_size, file_path, positions):
+        '''
+        This method creates context windows for all positions in a file.
+        The positions are sorted by line, so each line is read
+        and tokenized only once.
+        @param 'window_size': window size.
+        @param 'file_path': a path to the file.
+        @param 'positions': positions of the words in question.
+        @return: a list of context windows sorted by line.
+        '''
+        return list(self.iter_file_cws(window_size, file_path, positions))
+
+    def iter_file_cws(self, window_size, file_path, positions):
+        '''
+        This generator creates context windows for the positions in a file
+        one by one, so the lines after the last window that is needed
+        are not read at all.
+        @param 'window_size': window size.
+        @param 'file_path': a path to the file.
+        @param 'positions': positions of the words in question.
+        @return: context windows sorted by line.
+        '''
+        tokenizer = ToTokenize()
+        line_num = None
+        for p in sorted(positions, key=position_key):
+            # Read and tokenize a line only when we come to a new one.
+            if p.line != line_num:
+                line_num = p.line
+                line = self.store.get_line(file_path, line_num)
+                tokens = list(tokenizer.tokenize_reduced(line))
+                starts = [token.start for token in tokens]
+            left_border, right_border = self.get_borders(window_size, tokens, starts, p)
+            yield ContextWindow([p], left_border, right_border, line)
+
     def get_several_cws(self, search_results, window_size): 
         '''
         This method gets context windows for each position in a given dictionary.
@@ -180,15 +250,18 @@ class Contexter:
         # Its keys will be file names and values -- list of the context windows.
         cws = {}
         for file_name in search_results:
-            # Create an empty list for context_windows.
-            cws[file_name] = []            
-            # For each position get a context window.
-            for position in search_results[file_name]:
-                cw = self.get_one_cw(window_size, file_name, position)
-                cws[file_name].append(cw)                
+            # Get context windows for all positions in the file at once.
+            cws[file_name] = self.get_file_cws(window_size, file_name, search_results[file_name])
         return cws
 
     
+    @staticmethod
+    def window_key(cw):
+        '''
+        Windows are ordered by the number of their line and then by the left context.
+        '''
+        return (cw.position[0].line, cw.left_cont)
+
     def check_intersection(self, cw_1, cw_2):
         '''
         This method checks if two windows are intersected.
@@ -196,14 +269,12 @@ class Contexter:
         @param 'cw_2': the second window.
         @return: a boolean variable that is 'True' if the windows are intersected.
         '''
-        intersection = False
-        # If the left context of the window is bigger than that of
-        # the another one,
-        # and the line of the window is same as that of
-        # the another one, then the windows are intersected.
-        if(cw_1.right_cont > cw_2.left_cont and cw_1.line == cw_2.line):
-            intersection = True            
-        return intersection     
+        # If the right context of the window is bigger than the left context
+        # of the another one, and the windows are in the same line,
+        # then the windows are intersected. The lines are compared by their
+        # numbers, not by their text.
+        return (cw_1.right_cont > cw_2.left_cont
+                and cw_1.position[0].line == cw_2.position[0].line)
 
     def unite_windows(self, cw_1, cw_2):  
         '''
@@ -215,33 +286,39 @@ class Contexter:
         # Add the position of the second window to that of the
         # first one.
         cw_1.position.extend(cw_2.position)
-        # Write right context of the second window tothat of the
-        # first one.
-        cw_1.right_cont = cw_2.right_cont
+        # The second window can be inside the first one, so the right
+        # context of the united window is the biggest of the two.
+        cw_1.right_cont = max(cw_1.right_cont, cw_2.right_cont)
         return cw_1
 
     def unite_cws(self, cws):
         '''
         This method unites intersected context windows.
-        @param 'cws': a dictionary of context windows.
-        @return: a list of context windows with united intersections.
+        The windows are sorted by line and left context, and then
+        each window is either added to the last united one or starts a new one,
+        so the list is passed only once.
+        @param 'cws': a list of context windows.
+        @return: a new list of context windows with united intersections.
         '''        
-                    
-        # This is a counter to allow us perform iterations.
-        i = 0
-        # For our convenience write a list of context windows
-        # in 'array_windows'
-        array_windows = cws
+        return list(self.iter_united(sorted(cws, key=self.window_key)))
 
-        while i < len(cws) - 1:
-            #print(array_windows[i])
-            # If context windows are intersected, unite them.                
-            if self.check_intersection(array_windows[i], array_windows[i + 1]):                    
-                array_windows[i] = self.unite_windows(array_windows[i], array_windows[i + 1])
-                # Delete the second window.
-                del array_windows[i + 1]
-            i += 1           
-        return array_windows
+    def iter_united(self, cws):
+        '''
+        This generator unites intersected context windows as they come.
+        A window is yielded as soon as the next one doesn't intersect it.
+        @param 'cws': context windows sorted by line.
+        @return: united context windows.
+        '''
+        current = None
+        for cw in cws:
+            if current is not None and self.check_intersection(current, cw):
+                current = self.unite_windows(current, cw)
+            else:
+                if current is not None:
+                    yield current
+                current = cw
+        if current is not None:
+            yield current
 
     def get_united_cws(self, search_results, window_size):
         '''
@@ -282,7 +359,7 @@ class Contexter:
         for file_name in cws:            
             for cw in cws[file_name]:
                 # Extend the context to the boundaries of the sentence.
-                cw.extend_to_sentence()
+                cw.extend_to_sentence(self.store.get_sentence_ends(file_name, cw.position[0].line))
                 #print(cw)
             # Unite intersected windows.
             cws[file_name] = self.unite_cws(cws[file_name])                
@@ -294,8 +371,8 @@ class Contexter:
         and makes words of the query bold.
         @param 'search_results': results of the search.
         @param 'window_size': a size of the future windows.
-        @return: a dictionary of context windows with bold query words
-        and without intersections.
+        @return: a dictionary of context windows without intersections.
+        The windows with bold query words are in their attribute 'highlighted'.
         '''
         if search_results == {}:
             return{}
@@ -306,7 +383,7 @@ class Contexter:
         cws = self.get_united_cws(search_results, window_size)
         for file_name in cws:
             for cw in cws[file_name]:
-                cw.make_bold()                
+                cw.make_bold(self.markup)
         return cws
     
     def get_several_cws_limited(self, search_results, window_size, doclimit, docoffset): 
@@ -333,17 +410,17 @@ class Contexter:
         # Create an empty dictionary that we will fill in later.
         # Its keys will be file names and values -- list of the context windows.
         cws = {}
-        sorted_file_names = sorted(search_results)
+        # The files are taken in the order of the search results: the best
+        # ones first if they are ranked, otherwise in the chronological order.
+        sorted_file_names = list(search_results)
         print(sorted_file_names)
         for i, file_name in enumerate(sorted_file_names):            
             # Exit the cycle if 'i' is out of limit.
             if i >= docoffset + doclimit:
                 break
             if i >= docoffset:
-                cws[file_name] = []
-                # For each position get a context window.
-                for position in search_results[file_name]:                    
-                    cws[file_name].append(self.get_one_cw(window_size, file_name, position))                
+                # Get context windows for all positions in the file at once.
+                cws[file_name] = self.get_file_cws(window_size, file_name, search_results[file_name])
         return cws
 
     def get_united_cws_limited(self, search_results, window_size, doclimit, docoffset):
@@ -402,12 +479,12 @@ class Contexter:
         for file_name in cws:            
             for cw in cws[file_name]:
                 # Extend the context to the boundaries of the sentence.
-                cw.extend_to_sentence()
+                cw.extend_to_sentence(self.store.get_sentence_ends(file_name, cw.position[0].line))
             # Unite intersected windows.
             cws[file_name] = self.unite_cws(cws[file_name])
         return cws
 
-    def get_bold_cws_limited(self, search_results, window_size, doclimit, docoffset, lim_of_pairs):
+    def get_bold_cws_limited(self, search_results, window_size, doclimit, docoffset, lim_of_pairs, query=None):
         '''
         This method creates multi-query, bold context windows so that they
         conform to a user's limit and offset.
@@ -417,6 +494,7 @@ class Contexter:
         @param 'docoffset': the number of the first document on the page.
         @param 'lim_of_pairs': the number of the first quote on the page,
         and the number of quotes on the page in general for a certain document.
+        @param 'query': the query the results were found for, see get_page_quotes().
         @return: a dictionary of multi-query, bold context windows within the limit established
         by the user.
         '''
@@ -438,36 +516,114 @@ class Contexter:
             for tuple_element in pair:
                 if not isinstance(tuple_element, int):
                     raise TypeError
-        # Getting united context windows
-        cws = self.get_united_cws_limited(search_results, window_size, doclimit, docoffset)
-        # Sorting file names in the chronological order.
-        sorted_file_names = sorted(cws)
         # Creating an empty dictionary for required quotes only.
         # It is to be returned.
         result = {}
-        # Iterating through the file names.
-        for i, sorted_fn in enumerate(sorted_file_names):
+        # Iterating through the file names in the order of the search results.
+        for i, file_name in enumerate(search_results):
             # Exit the cycle if 'i' is out of limit.
             if i >= docoffset + doclimit:
                 break
             if i >= docoffset:
-                # Creating an empty list for required context windows only, belonging
-                # to the file at hand.
-                result[sorted_fn] = []
-                # Iterating through the pairs offsets and limits.
-                for lim_of_pair in lim_of_pairs:
-                    # Iterating through the context windows belonging to the file at hand.
-                    for t, cw in enumerate(cws[sorted_fn]):
-                        # Exit the cycle if 't' is out of limit.
-                        if t >= lim_of_pair[0] + lim_of_pair[1]:
-                            break
-                        if t >= lim_of_pair[0]:
-                            # Append the bold context window in the resulting list.
-                            result[sorted_fn].append(cw.make_bold())               
+                result[file_name] = []
+                # The pair of the document is chosen by its number on the page.
+                # A document without a pair gets no quotes.
+                if i - docoffset >= len(lim_of_pairs):
+                    continue
+                offset, limit = lim_of_pairs[i - docoffset]
+                # Only the quotes within the limit are created and made bold.
+                for quote in self.get_page_quotes(window_size, file_name, search_results[file_name],
+                                                  offset, limit, query):
+                    result[file_name].append(self.get_fragment(window_size, file_name, quote))
         return result
+
+    def iter_quotes(self, window_size, file_name, positions):
+        '''
+        This generator yields the united context windows of a file as quotes.
+        A quote is a pair of the positions of the window and the window itself.
+        @param 'window_size': a size of the windows.
+        @param 'file_name': the name of the file.
+        @param 'positions': the positions of the words of the query in the file.
+        @return: quotes.
+        '''
+        for cw in self.iter_united(self.iter_file_cws(window_size, file_name, positions)):
+            yield (tuple((p.start, p.end, p.line) for p in cw.position), cw)
+
+    def get_page_quotes(self, window_size, file_name, positions, offset, limit, query=None):
+        '''
+        This method gets the quotes of a file from 'offset' to 'offset + limit'.
+        The windows are created lazily and no window after the last required
+        quote is created. If there is a snippet cache, it remembers the positions
+        of the quotes found so far, so the next pages don't create the previous
+        windows again, and the quotes of the pages already seen are not created at all.
+        Such quotes have None instead of the window.
+        The positions are read only when new quotes have to be created,
+        so a page of the known quotes takes no time proportional to their number.
+        @param 'window_size': a size of the windows.
+        @param 'file_name': the name of the file.
+        @param 'positions': the positions of the words of the query in the file.
+        @param 'offset': the number of the first quote, starting from 0.
+        @param 'limit': the number of quotes.
+        @param 'query': the query the positions were found for. The quotes are
+        remembered under it. Without it they are remembered under all the positions.
+        @return: a list of quotes.
+        '''
+        offset = max(offset, 0)
+        end = offset + max(limit, 0)
+        if self.snippet_cache is None:
+            return list(islice(self.iter_quotes(window_size, file_name, positions), offset, end))
+        if query is None:
+            positions = sorted(positions, key=position_key)
+            layout_key = (file_name, tuple((p.start, p.end, p.line) for p in positions), window_size, 'layout')
+        else:
+            layout_key = (file_name, query, window_size, 'layout')
+        layout = self.snippet_cache.get(layout_key)
+        if layout is None:
+            layout = ([], False)
+        known_quotes, complete = layout
+        windows = {}
+        if not complete and len(known_quotes) < end:
+            # The quotes are consecutive groups of the sorted positions, so we
+            # continue from the first position after the known quotes.
+            if query is not None:
+                positions = sorted(positions, key=position_key)
+            used = sum(len(quote_positions) for quote_positions in known_quotes)
+            known_quotes = list(known_quotes)
+            first = len(known_quotes)
+            for quote_positions, cw in islice(self.iter_quotes(window_size, file_name, positions[used:]), end - first):
+                windows[len(known_quotes)] = cw
+                known_quotes.append(quote_positions)
+            complete = len(known_quotes) < end
+            self.snippet_cache.put(layout_key, (known_quotes, complete),
+                                   SNIPPET_SIZE + POSITION_SIZE * (len(positions) + used))
+        return [(known_quotes[t], windows.get(t)) for t in range(offset, min(end, len(known_quotes)))]
+
+    def get_fragment(self, window_size, file_name, quote):
+        '''
+        This method makes the words of the query in a quote bold.
+        The result is kept in the snippet cache under the file, the line,
+        the positions, the window size, the mode of the quote and the markup.
+        @param 'window_size': a size of the window.
+        @param 'file_name': the name of the file.
+        @param 'quote': a pair of the positions of the window and the window or None.
+        @return: the bold quote.
+        '''
+        quote_positions, cw = quote
+        if self.snippet_cache is None:
+            return cw.make_bold(self.markup)
+        key = (file_name, quote_positions[0][2], quote_positions, window_size, 'bold', self.markup)
+        fragment = self.snippet_cache.get(key)
+        if fragment is None:
+            if cw is None:
+                # The window was not created, so create it from its positions.
+                positions = [PositionByLine(start, end, line) for start, end, line in quote_positions]
+                cw = self.unite_cws(self.get_file_cws(window_size, file_name, positions))[0]
+            fragment = cw.make_bold(self.markup)
+            self.snippet_cache.put(key, fragment, SNIPPET_SIZE + 2 * len(fragment))
+        return fragment
 if __name__ == '__main__':
     a = SearchEngine('database')
-    c = Contexter()
+    c = Contexter(DocumentStore('database'))
     #print(c.get_one_cw(5, 'tolstoy_reduced.txt', PositionByLine(40, 44, 0)))
     #print(c.get_several_cws_limited(a.multi_search('Анна Павловна'), 1, 2, 0))
     #print(c.get_several_cws(a.multi_search('Анна Павловна'), 3))
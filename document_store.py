@@ -0,0 +1,217 @@
+"""
+This module was made to get lines of indexed files.
+It consists of two classes: class MappedDocument and class DocumentStore.
+"""
+import os
+import mmap
+import shelve
+import threading
+import time
+from array import array
+from indexation import ENCODING
+from indexation import find_sentence_ends
+
+# Files that have already been mapped in this process. All the stores
+# share them, so each file is mapped only once.
+# The keys are the paths of the files as they are given.
+documents = {}
+documents_lock = threading.Lock()
+# The number of seconds a mapped file is used without checking if it was changed.
+CHECK_INTERVAL = 5
+
+
+class MappedDocument:
+    """
+    The class maps a file into memory and knows where its lines start.
+    """
+
+    def __init__(self, file_path, stat, offsets=None, sentences=None):
+        """
+        Map the file into memory.
+        @param 'file_path': a path to the file.
+        @param 'stat': the result of os.stat() for the file. It is used
+        later to find out if the file was changed.
+        @param 'offsets': the offsets of the lines recorded by ToIndex.
+        They are used only if they match the size of the file.
+        @param 'sentences': the ends of the sentences recorded by ToIndex.
+        They are used only together with the offsets.
+        """
+        self.file_path = file_path
+        # The time the file was last checked.
+        self.checked = time.monotonic()
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime_ns
+        self.inode = stat.st_ino
+        # An empty file can't be mapped.
+        if self.size > 0:
+            text_file = open(file_path, 'rb')
+            self.data = mmap.mmap(text_file.fileno(), 0, access=mmap.ACCESS_READ)
+            text_file.close()
+        else:
+            self.data = b''
+        if offsets is None or len(offsets) == 0 or offsets[-1] != self.size:
+            offsets = self.find_offsets()
+            sentences = None
+        self.offsets = offsets
+        self.sentences = sentences
+
+    def find_offsets(self):
+        """
+        This method finds the byte offsets of the starts of the lines.
+        The last offset is the size of the file.
+        @return: an array of offsets.
+        """
+        offsets = array('Q')
+        offset = 0
+        while offset < self.size:
+            offsets.append(offset)
+            end = self.data.find(b'\n', offset)
+            if end == -1:
+                break
+            offset = end + 1
+        offsets.append(self.size)
+        return offsets
+
+    def is_actual(self, stat):
+        """
+        This method checks that the file was not changed after it was mapped.
+        @param 'stat': the result of os.stat() for the file.
+        """
+        return (stat.st_size == self.size and stat.st_mtime_ns == self.mtime
+                and stat.st_ino == self.inode)
+
+    def get_line(self, line_num):
+        """
+        This method decodes a single line of the file.
+        @param 'line_num': the number of the line.
+        @return: the line.
+        """
+        if line_num < 0 or line_num >= len(self.offsets) - 1:
+            raise IndexError('There is no line %s in %s' % (line_num, self.file_path))
+        return self.data[self.offsets[line_num]:self.offsets[line_num + 1]].decode(ENCODING)
+
+    def get_sentence_ends(self, line_num):
+        """
+        This method gets the ends of the sentences of a line. If they were
+        not recorded by ToIndex, they are found in the line.
+        @param 'line_num': the number of the line.
+        @return: a sorted sequence of the offsets just after the end of each sentence.
+        """
+        if self.sentences is None:
+            return find_sentence_ends(self.get_line(line_num))
+        starts, ends = self.sentences
+        if line_num < 0 or line_num >= len(starts) - 1:
+            raise IndexError('There is no line %s in %s' % (line_num, self.file_path))
+        return ends[starts[line_num]:starts[line_num + 1]]
+
+
+class DocumentStore:
+    """
+    The class is needed to get a line of a file by its number
+    without reading the file from the beginning.
+    """
+
+    def __init__(self, db_name=None):
+        """
+        Create an object of DocumentStore. If the name of the database
+        is given, the offsets of the lines recorded by ToIndex.index_by_line()
+        are used. Otherwise the offsets are found when a file is mapped.
+        @param 'db_name': the name of the database.
+        """
+        self.db_name = db_name
+        self.lines = None
+        self.sentences = None
+        if db_name is not None:
+            self.lines = shelve.open(db_name + '.lines')
+            self.sentences = shelve.open(db_name + '.sentences')
+
+    def __del__(self):
+        """
+        In this method we close the database.
+        """
+        self.close()
+
+    def close(self):
+        """
+        This method closes the database.
+        """
+        if self.lines is not None:
+            self.lines.close()
+            self.sentences.close()
+            self.lines = None
+            self.sentences = None
+
+    def reload(self):
+        """
+        This method reopens the database after the files were indexed again,
+        so that the new offsets of the lines and the ends of the sentences are used.
+        The mapped files are mapped again when they are used.
+        """
+        with documents_lock:
+            self.close()
+            if self.db_name is not None:
+                self.lines = shelve.open(self.db_name + '.lines')
+                self.sentences = shelve.open(self.db_name + '.sentences')
+            documents.clear()
+
+    def get_document(self, file_path):
+        """
+        This method gets a mapped file. The file is mapped again
+        only if it was changed. To avoid a system call for every line,
+        a mapped file is checked at most once in CHECK_INTERVAL seconds
+        and after reload().
+        @param 'file_path': a path to the file.
+        @return: an object of MappedDocument.
+        """
+        with documents_lock:
+            document = documents.get(file_path)
+            now = time.monotonic()
+            if document is not None and now - document.checked < CHECK_INTERVAL:
+                return document
+            stat = os.stat(file_path)
+            if document is not None and document.is_actual(stat):
+                document.checked = now
+            else:
+                offsets = None
+                sentences = None
+                if self.lines is not None and file_path in self.lines:
+                    offsets = self.lines[file_path]
+                    sentences = self.sentences.get(file_path)
+                document = MappedDocument(file_path, stat, offsets, sentences)
+                documents[file_path] = document
+        return document
+
+    def get_offsets(self, file_path):
+        """
+        This method gets the byte offsets of the starts of the lines of a file.
+        The last offset is the size of the file.
+        @param 'file_path': a path to the file.
+        @return: an array of offsets.
+        """
+        return self.get_document(file_path).offsets
+
+    def get_line(self, file_path, line_num):
+        """
+        This method gets a line of a file by its number.
+        @param 'file_path': a path to the file.
+        @param 'line_num': the number of the line.
+        @return: the line.
+        """
+        if not isinstance(file_path, str):
+            raise TypeError
+        if not isinstance(line_num, int):
+            raise TypeError
+        return self.get_document(file_path).get_line(line_num)
+
+    def get_sentence_ends(self, file_path, line_num):
+        """
+        This method gets the ends of the sentences of a line of a file.
+        @param 'file_path': a path to the file.
+        @param 'line_num': the number of the line.
+        @return: a sorted sequence of the offsets just after the end of each sentence.
+        """
+        if not isinstance(file_path, str):
+            raise TypeError
+        if not isinstance(line_num, int):
+            raise TypeError
+        return self.get_document(file_path).get_sentence_ends(line_num)
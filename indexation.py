@@ -1,16 +1,36 @@
 """
 This module was made to index tokens.
-It consists of two classes: class Position and class ToIndex.
+It consists of six classes: class Position, class PositionByLine,
+class PostingList, class DocumentTable, class TermDictionary and class ToIndex.
 """
 from tokenization import ToTokenize
 from tokenization import TokenWithType
+from tokenization import restore_state
 import shelve
+import dbm
 import os
+import locale
+import re
+import pickle
+import heapq
+import tempfile
+import hashlib
+import mmap
+import struct
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import query_cache
+from array import array
+
+# The encoding that 'open()' uses by default. Files are read as bytes
+# when they are indexed by line, so we decode them with it ourselves.
+ENCODING = locale.getpreferredencoding(False)
 
 class Position:
     """
     The class is needed to define the start and the end of a token being indexed.
     """
+    __slots__ = ('start', 'end')
     
     def __init__(self, start, end):
         """
@@ -34,7 +54,17 @@ class Position:
         """
         return self.start == obj.start and self.end == obj.end
 
+    def __setstate__(self, state):
+        """
+        This method restores a pickled position.
+        """
+        restore_state(self, state)
+
 class PositionByLine:
+    """
+    The class is needed to define the start, the end and the line of a token.
+    """
+    __slots__ = ('start', 'end', 'line')
     
     def __init__(self, start, end, line):
         """
@@ -60,6 +90,12 @@ class PositionByLine:
         """
         return self.start == obj.start and self.end == obj.end and self.line == obj.line
 
+    def __setstate__(self, state):
+        """
+        This method restores a pickled position.
+        """
+        restore_state(self, state)
+
     def __lt__(self, obj):
         """
         We need this method to sort objects of class PositionByLine.
@@ -74,6 +110,559 @@ class PositionByLine:
         
     
 
+def encode_number(number, data):
+    """
+    This function appends a non-negative number to a bytearray
+    as a varint: seven bits in each byte, the high bit is set
+    in every byte except the last one.
+    @param 'number': a non-negative number.
+    @param 'data': a bytearray.
+    """
+    while number > 0x7f:
+        data.append((number & 0x7f) | 0x80)
+        number >>= 7
+    data.append(number)
+
+
+def encode_difference(difference, data):
+    """
+    This function appends a number that can be negative to a bytearray.
+    The sign is moved to the lowest bit (zigzag encoding), so that small
+    numbers of both signs take one byte.
+    @param 'difference': a number.
+    @param 'data': a bytearray.
+    """
+    if difference >= 0:
+        encode_number(difference << 1, data)
+    else:
+        encode_number((-difference << 1) - 1, data)
+
+
+def decode_numbers(data):
+    """
+    This generator yields the varints written to the data one after another.
+    @param 'data': bytes with varints.
+    @return: numbers
+    """
+    number = 0
+    shift = 0
+    for byte in data:
+        number |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield number
+            number = 0
+            shift = 0
+
+
+def decode_difference(number):
+    """
+    This function restores a number written by encode_difference().
+    """
+    if number & 1:
+        return -((number + 1) >> 1)
+    return number >> 1
+
+
+class PostingList:
+    """
+    The class stores the positions of a word in a file packed into bytes.
+    Each position is written as three varints: the difference between its
+    line and the line of the previous position, the difference between
+    the starts (or the start itself if the line is new), and the length
+    of the word. If the list stores ordinals, the fourth varint is
+    the difference between the numbers of the word in the line
+    (or the number itself if the line is new). The ordinals are needed
+    to find phrases. The positions are decoded only when they are needed.
+    """
+
+    def __init__(self, data=b'', count=0, last_line=0, last_start=0, last_ordinal=0, ordinals=False):
+        """
+        Create a list of positions.
+        @param 'data': the packed positions.
+        @param 'count': the number of the positions.
+        @param 'last_line': the line of the last position.
+        @param 'last_start': the start of the last position.
+        @param 'last_ordinal': the number of the word of the last position in its line.
+        @param 'ordinals': whether the numbers of the words in their lines are stored.
+        The lists pickled before the ordinals were introduced don't have them.
+        """
+        self.data = bytearray(data)
+        self.count = count
+        self.last_line = last_line
+        self.last_start = last_start
+        self.last_ordinal = last_ordinal
+        self.ordinals = ordinals
+        # The positions decoded by __getitem__(), until a position is added.
+        self.decoded = None
+
+    def append(self, position, ordinal=None):
+        """
+        This method packs one more position into the list.
+        @param 'position': an object of PositionByLine.
+        @param 'ordinal': the number of the word in its line.
+        It is required if the list stores ordinals.
+        """
+        if self.ordinals and ordinal is None:
+            raise ValueError('The list stores the numbers of the words')
+        self.decoded = None
+        encode_difference(position.line - self.last_line, self.data)
+        if position.line != self.last_line:
+            self.last_start = 0
+            self.last_ordinal = 0
+        encode_difference(position.start - self.last_start, self.data)
+        encode_number(position.end - position.start, self.data)
+        if self.ordinals:
+            encode_difference(ordinal - self.last_ordinal, self.data)
+            self.last_ordinal = ordinal
+        self.last_line = position.line
+        self.last_start = position.start
+        self.count += 1
+
+    def extend(self, positions):
+        """
+        This method packs several positions into the list.
+        @param 'positions': objects of PositionByLine or a PostingList.
+        The numbers of the words of a PostingList are packed too. If the numbers
+        of the new positions are not known, the list stops storing them.
+        """
+        ordinals = isinstance(positions, PostingList) and positions.ordinals
+        if self.ordinals and not ordinals:
+            self.drop_ordinals()
+        if self.ordinals:
+            for position, ordinal in positions.with_ordinals():
+                self.append(position, ordinal)
+        else:
+            for position in positions:
+                self.append(position)
+
+    def drop_ordinals(self):
+        """
+        This method packs the positions of the list again without the numbers of the words.
+        """
+        positions = list(self)
+        self.__init__()
+        for position in positions:
+            self.append(position)
+
+    def __iter__(self):
+        """
+        This method decodes the positions one by one.
+        """
+        for position, ordinal in self.decode():
+            yield position
+
+    def with_ordinals(self):
+        """
+        This generator decodes the positions together with the numbers
+        of the words in their lines.
+        @return: pairs of a position and its number.
+        """
+        if not self.ordinals:
+            raise ValueError('The list does not store the numbers of the words')
+        return self.decode()
+
+    def decode(self):
+        """
+        This generator decodes the positions and the numbers of the words.
+        The number is None if the list doesn't store them.
+        """
+        numbers = decode_numbers(self.data)
+        line = 0
+        start = 0
+        ordinal = None
+        for line_difference in numbers:
+            if line_difference:
+                line += decode_difference(line_difference)
+                start = 0
+                ordinal = 0
+            start += decode_difference(next(numbers))
+            position = PositionByLine(start, start + next(numbers), line)
+            if self.ordinals:
+                ordinal = (ordinal or 0) + decode_difference(next(numbers))
+            yield position, ordinal
+
+    def __len__(self):
+        """
+        The number of the positions is known without decoding them.
+        """
+        return self.count
+
+    def __getitem__(self, index):
+        """
+        This method gets a position (or a list of positions) by index.
+        The positions are decoded once for all the calls.
+        """
+        if self.decoded is None:
+            self.decoded = list(self)
+        return self.decoded[index]
+
+    def __eq__(self, obj):
+        """
+        A list of positions is equal to any sequence of the same positions.
+        """
+        try:
+            return list(self) == list(obj)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        """
+        This method creates a string representation of the list.
+        """
+        return repr(list(self))
+
+    def __reduce__(self):
+        """
+        Only the packed bytes are pickled.
+        """
+        return (PostingList, (bytes(self.data), self.count, self.last_line, self.last_start,
+                              self.last_ordinal, self.ordinals))
+
+
+# A sentence ends with '.', '?' or '!' followed by a space or the end of the line.
+SENTENCE_END = re.compile(r'[.?!](?=\s|$)')
+
+
+def find_sentence_ends(line):
+    """
+    This function finds where the sentences of a line end.
+    @param: the line
+    @return: a sorted array of the offsets just after the end of each sentence.
+    """
+    return array('L', [match.end() for match in SENTENCE_END.finditer(line)])
+
+
+def index_file_by_line(file_name):
+    """
+    This function tokenizes a file by line and collects the positions
+    of every word in it.
+    @param: the name of the file
+    @return: a dictionary with words as keys and objects of PostingList
+    as values, an array with the byte offsets of the lines, a dictionary
+    with the size, the time of modification and the hash of the contents
+    of the file, and the ends of the sentences. The size and the time are
+    taken before the file is read, so a change made while it is read
+    is noticed next time.
+    The ends of the sentences are a pair of arrays: the ends of the line 'n'
+    are ends[starts[n]:starts[n + 1]].
+    """
+    # Create an object of ToTokenize.
+    tokenizer = ToTokenize()
+    # This dictionary will contain the positions of each word in the file.
+    postings = {}
+    # This array will contain the byte offset of the start of each line.
+    offsets = array('Q')
+    offset = 0
+    # The ends of the sentences of all the lines and where the ends of each line start.
+    sentence_ends = array('L')
+    sentence_starts = array('L')
+    # The hash lets us find out later if the file was really changed.
+    content_hash = hashlib.sha1()
+    # Open file in binary mode so that we know how many bytes each line takes.
+    text_file = open(file_name, 'rb')
+    stat = os.fstat(text_file.fileno())
+    # Read the file by line
+    for num, raw_line in enumerate(text_file):
+        offsets.append(offset)
+        offset += len(raw_line)
+        content_hash.update(raw_line)
+        string = raw_line.decode(ENCODING)
+        sentence_starts.append(len(sentence_ends))
+        sentence_ends.extend(find_sentence_ends(string))
+        #Tokenize each string of the file and 
+        # save resulting tokens to the list 'tokens'
+        tokens = tokenizer.tokenize_reduced(string)
+        for ordinal, token in enumerate(tokens):
+            # For each token in the list create an object of Position.
+            position = PositionByLine(token.start, token.start + len(token.wordform), num)
+            # Pack the position and the number of the token in the line
+            # into the list of positions of the token.
+            posting_list = postings.get(token.wordform)
+            if posting_list is None:
+                posting_list = postings[token.wordform] = PostingList(ordinals=True)
+            posting_list.append(position, ordinal)
+    # Close the file.
+    text_file.close()
+    # The last offset is the size of the file, so the line 'n'
+    # always lies between offsets[n] and offsets[n + 1].
+    offsets.append(offset)
+    sentence_starts.append(len(sentence_ends))
+    content = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': content_hash.hexdigest()}
+    return postings, offsets, content, (sentence_starts, sentence_ends)
+
+
+def hash_file(file_name):
+    """
+    This function gets the hash of the contents of a file
+    in the same way as index_file_by_line().
+    @param: the name of the file
+    @return: the hash
+    """
+    content_hash = hashlib.sha1()
+    text_file = open(file_name, 'rb')
+    for raw_line in text_file:
+        content_hash.update(raw_line)
+    text_file.close()
+    return content_hash.hexdigest()
+
+
+def read_run(run_file):
+    """
+    This generator reads the records of a run spilled to a temporary file.
+    @param 'run_file': the temporary file.
+    @return: pairs of a word and a dictionary {file_id: positions}.
+    """
+    run_file.seek(0)
+    while True:
+        try:
+            yield pickle.load(run_file)
+        except EOFError:
+            run_file.close()
+            return
+
+
+def map_in_order(executor, function, items, limit):
+    """
+    This generator applies a function to the items in a pool of workers
+    and yields the results in the order of the items. Unlike executor.map(),
+    at most 'limit' items are submitted at once, and the next ones are
+    submitted as the results are taken, so the results that are not taken
+    yet don't keep the whole corpus in memory.
+    @param 'executor': an object of ProcessPoolExecutor.
+    @param 'function': the function.
+    @param 'items': the items.
+    @param 'limit': the largest number of items submitted and not taken yet.
+    @return: the results.
+    """
+    futures = deque()
+    for item in items:
+        if len(futures) >= limit:
+            yield futures.popleft().result()
+        futures.append(executor.submit(function, item))
+    while futures:
+        yield futures.popleft().result()
+
+
+def iterate_bits(bitmap):
+    """
+    This generator yields the ids of the files of a bitmap in increasing order.
+    @param 'bitmap': a number, the bit 'n' of which is set if the file 'n' is in the set.
+    @return: ids of the files.
+    """
+    while bitmap:
+        # The lowest bit that is set.
+        lowest = bitmap & -bitmap
+        yield lowest.bit_length() - 1
+        bitmap ^= lowest
+
+
+class DocumentTable:
+    """
+    The class gives every indexed file a small number (its id), so that
+    the positions in the database are stored under the ids instead of
+    the names of the files. The id of a file never changes.
+    """
+
+    def __init__(self, db_name, flag='c'):
+        """
+        Open the table of the database.
+        @param 'db_name': the name of the database.
+        @param 'flag': 'c' to create the table if it doesn't exist or 'r' to read it.
+        A database created before the table was introduced has no table,
+        and its positions are stored under the names of the files.
+        """
+        try:
+            self.db = shelve.open(db_name + '.docs', flag)
+        except dbm.error:
+            if flag != 'r':
+                raise
+            self.db = {}
+        # The names of the files that were already looked up.
+        self.names = {}
+
+    def close(self):
+        """
+        This method closes the table.
+        """
+        if isinstance(self.db, shelve.Shelf):
+            self.db.close()
+
+    def sync(self):
+        """
+        This method saves the table.
+        """
+        self.db.sync()
+
+    def get_id(self, file_name):
+        """
+        This method gets the id of a file and gives it a new one
+        if the file has not been indexed yet.
+        @param: the name of the file
+        @return: the id
+        """
+        doc_id = self.db.get('name:' + file_name)
+        if doc_id is None:
+            doc_id = self.db.get('count', 0)
+            self.db['name:' + file_name] = doc_id
+            self.db['id:%d' % doc_id] = file_name
+            self.db['count'] = doc_id + 1
+        return doc_id
+
+    def find_id(self, file_name):
+        """
+        This method gets the id of a file without giving it a new one.
+        @param: the name of the file
+        @return: the id or None if the file has no id.
+        """
+        return self.db.get('name:' + file_name)
+
+    def get_name(self, doc_id):
+        """
+        This method gets the name of a file by its id.
+        @param 'doc_id': the id. The name itself is returned
+        if the database stores the names of the files.
+        @return: the name of the file
+        """
+        if isinstance(doc_id, str):
+            return doc_id
+        name = self.names.get(doc_id)
+        if name is None:
+            name = self.names[doc_id] = self.db['id:%d' % doc_id]
+        return name
+
+    def __len__(self):
+        """
+        The number of the ids given.
+        """
+        return self.db.get('count', 0)
+
+
+class TermDictionary:
+    """
+    The class gives the sorted list of all the words of the database, so that
+    the words starting with a prefix are found by binary search instead of
+    reading every key of the database. The words are stored in a file that
+    is mapped into memory: the number of the words, the offsets of the words
+    and the words themselves encoded in UTF-8, one after another.
+    The words are sorted by their bytes, which is the same as sorting them
+    by their characters in UTF-8.
+    """
+
+    # The format of the number of the words and of an offset.
+    NUMBER = struct.Struct('<I')
+
+    def __init__(self, db_name):
+        """
+        Open the dictionary of the database. A database created before
+        the dictionary was introduced has no dictionary, and it is empty then.
+        @param 'db_name': the name of the database.
+        """
+        self.file_name = db_name + '.terms'
+        self.data = None
+        self.count = 0
+        try:
+            with open(self.file_name, 'rb') as terms_file:
+                self.data = mmap.mmap(terms_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return
+        self.count = self.NUMBER.unpack_from(self.data, 0)[0]
+        # The words start after the number and the offsets.
+        self.start = self.NUMBER.size * (self.count + 2)
+
+    def close(self):
+        """
+        This method closes the dictionary.
+        """
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+            self.count = 0
+
+    def __len__(self):
+        """
+        The number of the words.
+        """
+        return self.count
+
+    def __getitem__(self, index):
+        """
+        This method gets the word with a number.
+        @param 'index': the number of the word in the sorted list.
+        """
+        if not 0 <= index < self.count:
+            raise IndexError
+        return self.get_bytes(index).decode('utf-8')
+
+    def get_bytes(self, index):
+        """
+        This method gets the encoded word with a number.
+        """
+        begin, end = struct.unpack_from('<2I', self.data, self.NUMBER.size * (index + 1))
+        return self.data[self.start + begin:self.start + end]
+
+    def find(self, word):
+        """
+        This method finds the place of a word by binary search.
+        @param 'word': the word.
+        @return: the number of the first word that is not less than this one.
+        """
+        key = word.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_bytes(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def iterate_prefix(self, prefix):
+        """
+        This generator yields the words that start with a prefix in sorted order.
+        @param 'prefix': the prefix, an empty one gives all the words.
+        @return: the words.
+        """
+        key = prefix.encode('utf-8')
+        for index in range(self.find(prefix), self.count):
+            word = self.get_bytes(index)
+            if not word.startswith(key):
+                return
+            yield word.decode('utf-8')
+
+    def __iter__(self):
+        """
+        This generator yields all the words in sorted order.
+        """
+        return self.iterate_prefix('')
+
+    @classmethod
+    def write(cls, db_name, words):
+        """
+        This method writes the dictionary of a database. The new file replaces
+        the old one at once, so the dictionaries that are already open
+        keep reading the old file.
+        @param 'db_name': the name of the database.
+        @param 'words': the words.
+        """
+        encoded = sorted(set(word.encode('utf-8') for word in words))
+        offsets = [0]
+        for word in encoded:
+            offsets.append(offsets[-1] + len(word))
+        file_name = db_name + '.terms'
+        with open(file_name + '.tmp', 'wb') as terms_file:
+            terms_file.write(cls.NUMBER.pack(len(encoded)))
+            terms_file.write(struct.pack('<%dI' % len(offsets), *offsets))
+            terms_file.write(b''.join(encoded))
+        os.replace(file_name + '.tmp', file_name)
+
+
+# The approximate number of bytes that one (word, file) entry of a run
+# takes in memory besides the packed positions: the dictionaries,
+# the PostingList object and the word itself.
+ENTRY_OVERHEAD = 250
+
 class ToIndex:
     """
     The class is needed to index a file. 
@@ -83,20 +672,79 @@ class ToIndex:
         In this method we create a database where indexed tokens
         are going to be stored.
         """
-        self.db = shelve.open(db_name, writeback=True)
+        self.db_name = db_name
+        # The positions are stored as {word: {file_id: positions}}.
+        self.db = shelve.open(db_name)
+        # The ids of the files.
+        self.docs = DocumentTable(db_name)
+        # The set of the files of every word as a bitmap over their ids.
+        self.bitmaps = shelve.open(db_name + '.bitmaps')
+        # The database was created before the bitmaps were introduced.
+        if len(self.bitmaps) == 0 and len(self.db) > 0:
+            self.build_bitmaps()
+        # The words added to the database and removed from it
+        # since the dictionary of the words was written.
+        self.added_words = set()
+        self.removed_words = set()
+        # The database was created before the dictionary was introduced,
+        # or the words were changed and the dictionary was not written,
+        # because the indexer was not closed.
+        terms = TermDictionary(db_name)
+        if not os.path.exists(db_name + '.terms') or len(terms) != len(self.db):
+            TermDictionary.write(db_name, self.db.keys())
+        terms.close()
+        # This database stores the byte offset of the start of each line
+        # for every file indexed by line.
+        self.lines = shelve.open(db_name + '.lines')
+        # The ends of the sentences of each file indexed by line.
+        self.sentences = shelve.open(db_name + '.sentences')
+        # This database stores the size, the time of modification, the hash
+        # and the words of every file indexed by line.
+        self.files = shelve.open(db_name + '.files')
+        # The number of words in every file indexed by line under the id of the file.
+        # It is used to rank the files.
+        self.lengths = shelve.open(db_name + '.lengths')
 
     def __del__(self):
         """
-        In this method we close the database.
+        In this method we close the database. The dictionary of the words
+        is not written here, see close().
         """
+        self.close_databases()
+
+    def close(self):
+        """
+        This method writes the dictionary of the words and closes the database.
+        It must be called when the indexing is finished, otherwise the words
+        added by index() and index_by_line() are not found by a prefix
+        until the database is opened by ToIndex again.
+        It can be called more than once.
+        """
+        if self.db is not None:
+            self.save_terms()
+        self.close_databases()
+
+    def close_databases(self):
+        """
+        This method closes the shelves of the database.
+        """
+        if self.db is None:
+            return
         self.db.close()
-               
-    def index(self, file_name):
+        self.lines.close()
+        self.sentences.close()
+        self.files.close()
+        self.lengths.close()
+        self.docs.close()
+        self.bitmaps.close()
+        self.db = None
+
+    @staticmethod
+    def check_file_name(file_name):
         """
-        This method gets indexes for the tokens in a file.
+        This method checks that a file can be indexed.
         @param: the name of the file
         """
-
         # Raise TypeError if the input type is not string      
         if not isinstance(file_name, str):
             raise(TypeError)
@@ -104,6 +752,171 @@ class ToIndex:
         files = os.listdir()
         if file_name not in files:
             raise(ValueError)
+
+    def merge_run(self, records):
+        """
+        This method writes the positions collected in memory to the database.
+        Each word is read from the database and written back only once.
+        @param 'records': pairs of a word and a dictionary {file_id: positions}.
+        """
+        for word, new_files in records:
+            files = self.db.get(word)
+            if files is None:
+                files = {}
+                self.added_words.add(word)
+                self.removed_words.discard(word)
+            bitmap = self.bitmaps.get(word, 0)
+            for doc_id, positions in new_files.items():
+                if doc_id in files:
+                    files[doc_id].extend(positions)
+                else:
+                    files[doc_id] = positions
+                bitmap |= 1 << doc_id
+            self.db[word] = files
+            self.bitmaps[word] = bitmap
+
+    def build_bitmaps(self):
+        """
+        This method creates the bitmaps of all the words of the database.
+        """
+        for word, files in self.db.items():
+            bitmap = 0
+            for doc_id in files:
+                # The files of the databases created before the ids were
+                # introduced are stored under their names and have no bits.
+                if isinstance(doc_id, int):
+                    bitmap |= 1 << doc_id
+            self.bitmaps[word] = bitmap
+        self.bitmaps.sync()
+
+    def save_terms(self):
+        """
+        This method writes the dictionary of the words again
+        if words were added to the database or removed from it.
+        The whole dictionary is rewritten, so it is done once for all the files
+        of bulk_index() and index_many(). After index() and index_by_line()
+        it is done by close() or when this method is called.
+        """
+        if not self.added_words and not self.removed_words:
+            return
+        terms = TermDictionary(self.db_name)
+        words = set(terms)
+        terms.close()
+        words -= self.removed_words
+        words |= self.added_words
+        TermDictionary.write(self.db_name, words)
+        self.added_words = set()
+        self.removed_words = set()
+               
+    def is_changed(self, file_name):
+        """
+        This method checks if a file was changed after it was indexed.
+        The hash is calculated only if the size of the file is the same
+        but the time of modification is different.
+        @param: the name of the file
+        @return: 'True' if the file has to be indexed again.
+        """
+        if file_name not in self.files:
+            return True
+        record = self.files[file_name]
+        stat = os.stat(file_name)
+        if stat.st_size != record['size']:
+            return True
+        if stat.st_mtime_ns == record['mtime']:
+            return False
+        if hash_file(file_name) != record['hash']:
+            return True
+        # The file was touched but not changed.
+        record['mtime'] = stat.st_mtime_ns
+        self.files[file_name] = record
+        return False
+
+    def remove_file(self, file_name):
+        """
+        This method removes all the positions of a file from the database.
+        Only the words of this file are read and rewritten.
+        @param: the name of the file
+        """
+        if not isinstance(file_name, str):
+            raise(TypeError)
+        if file_name not in self.files:
+            return
+        doc_id = self.docs.find_id(file_name)
+        for word in self.files[file_name]['words']:
+            files = self.db.get(word)
+            if files is None or doc_id not in files:
+                continue
+            del files[doc_id]
+            if files:
+                self.db[word] = files
+                self.bitmaps[word] = self.bitmaps.get(word, 0) & ~(1 << doc_id)
+            else:
+                del self.db[word]
+                self.removed_words.add(word)
+                self.added_words.discard(word)
+                if word in self.bitmaps:
+                    del self.bitmaps[word]
+        del self.files[file_name]
+        if str(doc_id) in self.lengths:
+            del self.lengths[str(doc_id)]
+        if file_name in self.lines:
+            del self.lines[file_name]
+        if file_name in self.sentences:
+            del self.sentences[file_name]
+        query_cache.invalidate(self.db_name)
+
+    def get_changed_files(self, file_names):
+        """
+        This method chooses the files that have to be indexed and removes
+        the old positions of the ones that were changed.
+        @param 'file_names': the names of the files.
+        @return: a list of the names of the files to be indexed.
+        """
+        changed_files = []
+        seen = set()
+        for file_name in file_names:
+            if file_name in seen:
+                continue
+            seen.add(file_name)
+            if not self.is_changed(file_name):
+                continue
+            self.remove_file(file_name)
+            changed_files.append(file_name)
+        return changed_files
+
+    @staticmethod
+    def describe_file(postings, content):
+        """
+        This method makes the record of an indexed file.
+        @param 'postings': the positions of the words in the file.
+        @param 'content': the size, the time of modification and the hash
+        of the file, see index_file_by_line().
+        @return: the record and the number of words of the file.
+        """
+        record = {'size': content['size'],
+                  'mtime': content['mtime'],
+                  'hash': content['hash'],
+                  'words': sorted(postings)}
+        return record, sum(len(posting_list) for posting_list in postings.values())
+
+    def record_file(self, file_name, record, length):
+        """
+        This method records the size, the time of modification, the hash,
+        the words and the number of words of an indexed file.
+        A file with a record is not indexed again until it is changed, so it
+        must be recorded only after its positions are saved.
+        @param: the name of the file
+        @param 'record', 'length': the result of describe_file().
+        """
+        self.files[file_name] = record
+        self.lengths[str(self.docs.get_id(file_name))] = length
+
+    def index(self, file_name):
+        """
+        This method gets indexes for the tokens in a file.
+        @param: the name of the file
+        """
+        self.check_file_name(file_name)
         # Create an object of ToTokenize.
         tokenizer = ToTokenize()
         # Open file
@@ -115,70 +928,199 @@ class ToIndex:
         # Tokenize the string and write resulting tokens (only alphabetical
         # and digital ones) to the list 'tokens'
         tokens = tokenizer.tokenize_reduced(text_string)
-        
-        
+        # This dictionary will contain the positions of each word in the file.
+        positions = {}
         for token in tokens:
             # For each token in the list create an object of Position.
             position = Position(token.start, token.start + len(token.wordform))
-            # Use method '.setdefault()' to write the token, its file_name
-            # and position to the database.
-            self.db.setdefault(token.wordform, {}).setdefault(file_name, []).append(position)
-            
-        # Use '.sync()' to save the database.
+            # Use method '.setdefault()' to collect the positions of the token.
+            positions.setdefault(token.wordform, []).append(position)
+        # Write the positions to the database.
+        doc_id = self.docs.get_id(file_name)
+        self.merge_run((word, {doc_id: positions[word]}) for word in positions)
+        # Use '.sync()' to save the database. The ids of the files
+        # are saved first, so that every id in the database has a name.
+        self.docs.sync()
         self.db.sync()
+        self.bitmaps.sync()
+        # The cached search results are not valid any more.
+        query_cache.invalidate(self.db_name)
 
     def index_by_line(self, file_name):
         """
         This method index a file by strings.
+        If the file has already been indexed and was not changed, nothing is done.
+        If it was changed, its old positions are replaced.
         param@: the name of the file
         """
+        self.check_file_name(file_name)
+        if not self.get_changed_files([file_name]):
+            return
+        postings, offsets, content, sentences = index_file_by_line(file_name)
+        self.lines[file_name] = offsets
+        self.sentences[file_name] = sentences
+        record, length = self.describe_file(postings, content)
+        # Write the positions to the database.
+        doc_id = self.docs.get_id(file_name)
+        self.merge_run((word, {doc_id: postings[word]}) for word in postings)
+        # Use '.sync()' to save the database. The ids of the files
+        # are saved first, so that every id in the database has a name.
+        self.docs.sync()
+        self.db.sync()
+        self.bitmaps.sync()
+        self.record_file(file_name, record, length)
+        # The cached search results are not valid any more.
+        query_cache.invalidate(self.db_name)
+        self.lines.sync()
+        self.sentences.sync()
+        self.files.sync()
+        self.lengths.sync()
 
-        # Raise TypeError if the input type is not string      
-        if not isinstance(file_name, str):
-            raise(TypeError)
-        
-        # Raise ValuError if filename doesn't exist.
-        files = os.listdir()
-        if file_name not in files:
-            raise(ValueError)
+    def bulk_index(self, file_names, memory_limit=64 * 1024 * 1024):
+        """
+        This method indexes several files by line using a limited amount of memory.
+        The positions are collected in memory until they take about 'memory_limit'
+        bytes. Then they are sorted by word and spilled to a temporary file.
+        At the end all the spilled runs are merged, so each word of the database
+        is written only once.
+        param@ 'file_names': the names of the files.
+        param@ 'memory_limit': the approximate number of bytes a run can take.
+        """
+        if not isinstance(file_names, list):
+            raise TypeError
+        if not isinstance(memory_limit, int):
+            raise TypeError
+        for file_name in file_names:
+            self.check_file_name(file_name)
+        file_names = self.get_changed_files(file_names)
+        self.build_runs(file_names, map(index_file_by_line, file_names), memory_limit)
 
-        
-        # Create an object of ToTokenize.
-        tokenizer = ToTokenize()
-        # Open file
-        text_file = open(file_name, 'r')
-        # Read the file by line
-        for num, string in enumerate(text_file):
-            #Tokenize each string of the file and 
-            # save resulting tokens to the list 'tokens'
-            tokens = tokenizer.tokenize_reduced(string)
-        
-        
-            for token in tokens:
-                # For each token in the list create an object of Position.
-                position = PositionByLine(token.start, token.start + len(token.wordform), num)
-            
-                # Use method '.setdefault()' to write the token, its file_name
-                # and position to the database.
-                self.db.setdefault(token.wordform, {}).setdefault(file_name, []).append(position)
-                
-        # Close the file.
-        text_file.close()
-        # Use '.sync()' to save the database.
+    def index_many(self, file_names, workers=None, memory_limit=64 * 1024 * 1024):
+        """
+        This method indexes several files by line in parallel.
+        The files are tokenized in a pool of worker processes, and their
+        positions are merged into the database by this process in the same
+        way as in bulk_index(). At most twice as many files as there are
+        workers are tokenized ahead of the merging, so the memory is still
+        limited by 'memory_limit' and not by the size of all the files.
+        param@ 'file_names': the names of the files.
+        param@ 'workers': the number of processes. By default it is
+        the number of processors.
+        param@ 'memory_limit': the approximate number of bytes a run can take.
+        """
+        if not isinstance(file_names, list):
+            raise TypeError
+        if workers is not None and not isinstance(workers, int):
+            raise TypeError
+        if not isinstance(memory_limit, int):
+            raise TypeError
+        for file_name in file_names:
+            self.check_file_name(file_name)
+        file_names = self.get_changed_files(file_names)
+        if workers == 1 or len(file_names) < 2:
+            self.build_runs(file_names, map(index_file_by_line, file_names), memory_limit)
+            return
+        if workers is None:
+            workers = os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = map_in_order(executor, index_file_by_line, file_names, 2 * workers)
+            self.build_runs(file_names, results, memory_limit)
+
+    def build_runs(self, file_names, results, memory_limit):
+        """
+        This method collects the positions of the files into runs,
+        spills a run to the disk when it gets bigger than 'memory_limit'
+        and merges all the runs into the database.
+        param@ 'file_names': the names of the files.
+        param@ 'results': the results of index_file_by_line() for these files.
+        param@ 'memory_limit': the approximate number of bytes a run can take.
+        """
+        # The runs spilled to the disk.
+        runs = []
+        # The run that is being collected in memory.
+        run = {}
+        run_size = 0
+        # The records of the files are written after all the positions,
+        # so the files are indexed again if something fails before.
+        records = []
+        for file_name, (postings, offsets, content, sentences) in zip(file_names, results):
+            self.lines[file_name] = offsets
+            self.sentences[file_name] = sentences
+            records.append((file_name,) + self.describe_file(postings, content))
+            doc_id = self.docs.get_id(file_name)
+            for word, posting_list in postings.items():
+                run.setdefault(word, {})[doc_id] = posting_list
+                run_size += len(posting_list.data) + len(word) + ENTRY_OVERHEAD
+            if run_size > memory_limit:
+                runs.append(self.spill_run(run))
+                run = {}
+                run_size = 0
+        # Merge the runs. Each of them is sorted by word.
+        sources = [read_run(run_file) for run_file in runs]
+        sources.append(sorted(run.items()))
+        self.merge_run(self.group_records(heapq.merge(*sources, key=lambda record: record[0])))
+        # Use '.sync()' to save the database. The ids of the files
+        # are saved first, so that every id in the database has a name.
+        self.docs.sync()
         self.db.sync()
-        
-        
+        self.bitmaps.sync()
+        for file_name, record, length in records:
+            self.record_file(file_name, record, length)
+        self.save_terms()
+        # The cached search results are not valid any more.
+        query_cache.invalidate(self.db_name)
+        self.lines.sync()
+        self.sentences.sync()
+        self.files.sync()
+        self.lengths.sync()
 
+    @staticmethod
+    def spill_run(run):
+        """
+        This method writes a run sorted by word to a temporary file.
+        param@ 'run': a dictionary {word: {file_id: positions}}.
+        return@: the temporary file.
+        """
+        run_file = tempfile.TemporaryFile()
+        for word in sorted(run):
+            pickle.dump((word, run[word]), run_file, pickle.HIGHEST_PROTOCOL)
+        return run_file
 
+    @staticmethod
+    def group_records(records):
+        """
+        This generator unites the records of the same word that come from
+        different runs.
+        param@ 'records': pairs of a word and a dictionary {file_id: positions}
+        sorted by word.
+        return@: pairs of a word and a dictionary {file_id: positions}.
+        """
+        current_word = None
+        current_files = None
+        for word, files in records:
+            if word != current_word:
+                if current_files is not None:
+                    yield current_word, current_files
+                current_word = word
+                current_files = {}
+            for file_name, positions in files.items():
+                if file_name in current_files:
+                    current_files[file_name].extend(positions)
+                else:
+                    current_files[file_name] = positions
+        if current_files is not None:
+            yield current_word, current_files
 
-                
                     
 if __name__ == '__main__':
     a = ToIndex('database')
     a.index_by_line("tolstoy1.txt")
+    a.close()
     #a.index_by_line("tolstoy2.txt")
     #a.index_by_line("tolstoy3.txt")
     #a.index_by_line("tolstoy4.txt")
+    #a.bulk_index(["tolstoy1.txt", "tolstoy2.txt", "tolstoy3.txt", "tolstoy4.txt"])
+    #a.index_many(["tolstoy1.txt", "tolstoy2.txt", "tolstoy3.txt", "tolstoy4.txt"], workers=4)
     
     db= shelve.open('database')
     print(db['Анна'])
@@ -0,0 +1,134 @@
+"""
+This module was made to cache the results of the search.
+It consists of class LRUCache and functions that register caches
+of a database and invalidate them when the database is changed.
+"""
+import os
+import time
+import threading
+import weakref
+from collections import OrderedDict
+
+# Caches of every database opened in this process.
+# The keys are absolute names of the databases.
+registered_caches = {}
+registry_lock = threading.Lock()
+
+
+class LRUCache:
+    """
+    The class stores values up to a total size. When the size is exceeded,
+    the least recently used values are evicted. If the time to live is given,
+    the values older than it are not returned.
+    """
+
+    def __init__(self, max_size, ttl=None):
+        """
+        Create an empty cache.
+        @param 'max_size': the maximum total size of the values.
+        @param 'ttl': the number of seconds a value is kept, or None
+        if the values are kept until they are evicted.
+        """
+        if not isinstance(max_size, int):
+            raise TypeError
+        if ttl is not None and not isinstance(ttl, (int, float)):
+            raise TypeError
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        This method gets a value and marks it as recently used.
+        @param 'key': the key of the value.
+        @return: the value or None if it is not in the cache.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            # The value is too old.
+            if entry[2] is not None and entry[2] < time.monotonic():
+                del self.entries[key]
+                self.size -= entry[1]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """
+        This method puts a value into the cache and evicts the least
+        recently used values if the cache is too big.
+        A value bigger than the whole cache is not stored.
+        @param 'key': the key of the value.
+        @param 'value': the value.
+        @param 'size': the size of the value.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            if size > self.max_size:
+                return
+            expires = None
+            if self.ttl is not None:
+                expires = time.monotonic() + self.ttl
+            self.entries[key] = (value, size, expires)
+            self.size += size
+            while self.size > self.max_size:
+                self.size -= self.entries.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def clear(self):
+        """
+        This method removes all the values from the cache.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        """
+        The number of the values in the cache.
+        """
+        return len(self.entries)
+
+    def stats(self):
+        """
+        This method returns the counters of the cache.
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'entries': len(self.entries),
+                    'size': self.size}
+
+
+def register(db_name, cache):
+    """
+    This function registers a cache that depends on a database.
+    @param 'db_name': the name of the database.
+    @param 'cache': the cache.
+    """
+    key = os.path.abspath(db_name)
+    with registry_lock:
+        registered_caches.setdefault(key, weakref.WeakSet()).add(cache)
+
+
+def invalidate(db_name):
+    """
+    This function clears all the caches of a database. It is called
+    by ToIndex after the database is changed.
+    @param 'db_name': the name of the database.
+    """
+    key = os.path.abspath(db_name)
+    with registry_lock:
+        caches = list(registered_caches.get(key, ()))
+    for cache in caches:
+        cache.clear()
@@ -1,25 +1,254 @@
 import shelve
+import dbm
 import os
+import re
+import math
+import heapq
+import threading
+import query_cache
+from query_cache import LRUCache
+from boolean_query import QueryParser
+from boolean_query import Evaluation
+from boolean_query import is_boolean
+from boolean_query import WILDCARD_PATTERN
 from indexation import PositionByLine
+from indexation import DocumentTable
+from indexation import TermDictionary
+from indexation import iterate_bits
 from tokenization import ToTokenize
 from tokenization import TokenWithType
 
+def position_key(position):
+    '''
+    Positions are ordered by line and then by start.
+    '''
+    return (position.line, position.start)
+
+# The operator of a proximity query: the words are at most 'k' words apart.
+NEAR_PATTERN = re.compile(r'\bNEAR/(\d+)\b')
+
+def parse_query(query):
+    '''
+    This function finds out what kind of query it is.
+    A query in double quotes is a phrase: its words must follow one another
+    in the same line. A query with the operator NEAR/k means that all its words
+    must be in the same line at most 'k' words apart, in any order.
+    A query with AND, OR, NOT, parentheses or patterns is a boolean one, see boolean_query.
+    Otherwise the words can be anywhere in a file.
+    param@ 'query': a query.
+    return@: the kind of the query ('all', 'phrase', 'near' or 'boolean'), the words
+    of the query in their order and the distance for 'near'.
+    The words of a boolean query depend on the database, so they are
+    not returned and are found by SearchEngine.find_boolean().
+    A query that looks like a boolean one but can't be parsed as it,
+    for example text with a single parenthesis, is a simple query.
+    '''
+    tokenizer = ToTokenize()
+    if is_boolean(query):
+        try:
+            # The patterns are expanded later, here they are only checked.
+            QueryParser(lambda pattern: check_pattern(pattern) and []).parse(query)
+            return 'boolean', [], None
+        except ValueError:
+            pass
+    stripped = query.strip()
+    if len(stripped) > 1 and stripped[0] == '"' and stripped[-1] == '"':
+        return 'phrase', [word.wordform for word in tokenizer.tokenize_reduced(stripped[1:-1])], None
+    distances = [int(distance) for distance in NEAR_PATTERN.findall(query)]
+    if distances:
+        # If there are several operators, the smallest distance is used.
+        words = [word.wordform for word in tokenizer.tokenize_reduced(NEAR_PATTERN.sub(' ', query))]
+        return 'near', words, min(distances)
+    return 'all', [word.wordform for word in tokenizer.tokenize_reduced(query)], None
+
+def pattern_to_regex(pattern):
+    '''
+    This function makes a regular expression of a pattern
+    where '*' means any characters and '?' means one character.
+    '''
+    parts = WILDCARD_PATTERN.split(pattern)
+    wildcards = WILDCARD_PATTERN.findall(pattern)
+    regex = re.escape(parts[0])
+    for wildcard, part in zip(wildcards, parts[1:]):
+        regex += ('.*' if wildcard == '*' else '.') + re.escape(part)
+    return re.compile(regex)
+
+def check_pattern(pattern):
+    '''
+    This function checks that a pattern starts with at least MIN_PREFIX letters.
+    param@ 'pattern': a word where '*' means any characters and '?' means one character.
+    return@: the part of the pattern before the first wildcard.
+    '''
+    if not isinstance(pattern, str):
+        raise TypeError
+    prefix = WILDCARD_PATTERN.split(pattern, 1)[0]
+    if len(prefix) < MIN_PREFIX:
+        raise ValueError('The pattern %s must start with at least %d letters' % (pattern, MIN_PREFIX))
+    return prefix
+
+def find_phrases(lists):
+    '''
+    This function finds the phrases in a file.
+    param@ 'lists': a PostingList with ordinals of every word of the phrase, in order.
+    return@: a list of positions from the start of the first word
+    to the end of the last one, sorted by line and start.
+    '''
+    # The words after the first one are looked up by line and number.
+    following = []
+    for posting_list in lists[1:]:
+        following.append(dict(((position.line, ordinal), position)
+                              for position, ordinal in posting_list.with_ordinals()))
+    spans = []
+    for position, ordinal in lists[0].with_ordinals():
+        last = position
+        for shift, positions in enumerate(following, 1):
+            last = positions.get((position.line, ordinal + shift))
+            if last is None:
+                break
+        else:
+            spans.append(PositionByLine(position.start, last.end, position.line))
+    return spans
+
+def label_positions(word, posting_list):
+    '''
+    This generator yields the line, the number, the index of the word
+    and the position for every position of a word.
+    '''
+    for position, ordinal in posting_list.with_ordinals():
+        yield position.line, ordinal, word, position
+
+def find_near(lists, distance):
+    '''
+    This function finds the places of a file where all the words are in the same
+    line at most 'distance' words apart. The positions of all the words are merged
+    and a window is moved along them. The places don't overlap.
+    param@ 'lists': a PostingList with ordinals of every different word.
+    param@ 'distance': the largest difference between the numbers of the words.
+    return@: a list of positions from the start of the first word of a place
+    to the end of the last one, sorted by line and start.
+    '''
+    # The positions of all the words with the index of their word.
+    merged = heapq.merge(*[label_positions(word, posting_list) for word, posting_list in enumerate(lists)],
+                         key=lambda item: item[:2])
+    spans = []
+    # The positions in the current window and the number of times each word is in it.
+    window = []
+    counts = [0] * len(lists)
+    found = 0
+    first = 0
+    for line, ordinal, word, position in merged:
+        # A new line starts a new window.
+        if window and window[first][0] != line:
+            window = []
+            counts = [0] * len(lists)
+            found = 0
+            first = 0
+        window.append((line, ordinal, word, position))
+        if counts[word] == 0:
+            found += 1
+        counts[word] += 1
+        # Drop the positions that are too far from the new one or that are repeated later.
+        while (ordinal - window[first][1] > distance or counts[window[first][2]] > 1):
+            counts[window[first][2]] -= 1
+            if counts[window[first][2]] == 0:
+                found -= 1
+            first += 1
+        if found == len(lists):
+            spans.append(PositionByLine(window[first][3].start, position.end, line))
+            # The next place starts after this one.
+            window = []
+            counts = [0] * len(lists)
+            found = 0
+            first = 0
+    return spans
+
+# The approximate number of bytes a cached file and a cached packed position take.
+FILE_SIZE = 100
+POSITION_SIZE = 4
+
+# The parameters of BM25: how fast the weight of a word grows with the number
+# of times it is in a file, and how much the length of a file matters.
+K1 = 1.2
+B = 0.75
+# The key of the numbers of words of the files in the cache. The keys of
+# the queries are made of strings, so no query can have this key.
+LENGTHS_KEY = (None, 'lengths')
+# The largest number of words a pattern is replaced by.
+MAX_EXPANSIONS = 100
+# The largest number of words of the dictionary checked for a pattern.
+MAX_SCANNED = 10000
+# The smallest number of letters before the first wildcard of a pattern.
+# A pattern like '*ей' would check every word of the dictionary.
+MIN_PREFIX = 2
+
 class SearchEngine:
+    '''
+    This class searches the database created by ToIndex.
+    One object can be shared by several threads: the database
+    is read under a lock, and it can be reopened with reload().
+    The documents found for a query are kept in a cache, so the next
+    pages of the same query don't search the database again.
+    '''
 
-    def __init__(self, db_name):
-        
-        self.db = shelve.open(db_name)
+    def __init__(self, db_name, read_only=False, cache_size=32 * 1024 * 1024):
+        '''
+        Open the database.
+        param@ 'db_name': the name of the database.
+        param@ 'read_only': open the database only for reading. It must exist then.
+        param@ 'cache_size': the approximate number of bytes the cached results can take.
+        '''
+        self.db_name = db_name
+        self.flag = 'r' if read_only else 'c'
+        self.lock = threading.RLock()
+        self.db = shelve.open(db_name, self.flag)
+        # The database stores the ids of the files, the names are taken from this table.
+        self.docs = DocumentTable(db_name, self.flag)
+        self.bitmaps = self.open_bitmaps()
+        # The sorted words of the database to expand the patterns.
+        self.terms = TermDictionary(db_name)
+        # ToIndex clears this cache when it changes the database.
+        self.cache = LRUCache(cache_size)
+        query_cache.register(db_name, self.cache)
         
     def __del__(self):
 
-        self.db.close()
+        self.close()
+
+    def close(self):
+        '''
+        This method closes the database. It can be called more than once.
+        '''
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.docs.close()
+                if self.bitmaps is not None:
+                    self.bitmaps.close()
+                # The dictionary is not closed, because a pattern may still be
+                # expanded with it. Its file is unmapped when it is not used any more.
+                self.terms = None
+                self.db = None
+
+    def reload(self):
+        '''
+        This method reopens the database, so that the changes made by
+        ToIndex after the database was opened become visible.
+        '''
+        with self.lock:
+            self.close()
+            self.db = shelve.open(self.db_name, self.flag)
+            self.docs = DocumentTable(self.db_name, self.flag)
+            self.bitmaps = self.open_bitmaps()
+            self.terms = TermDictionary(self.db_name)
+            self.cache.clear()
         
     def search(self, query):
         '''
         This method performs search for a single word query.
         param@: a query
         return@: a dictionary with file names as keys and a list of
-        positions as values.
+        positions as values. The positions are packed into a PostingList
+        and are decoded only when the list is iterated.
         '''
         # Raise TypeError if the input type is not string      
         if not isinstance(query, str):
@@ -29,18 +258,376 @@ class SearchEngine:
         if query == "":
             raise ValueError('Empty query')
         
-        # Raise ValueError if the query doesn't match any key in the database.
-        if query not in self.db:
-            return ValueError("The query doesn't match any key in the database")
-        
-        # Return dictionary with files that match the query as keys and
-        # positions of the query in these files as values.
+        with self.lock:
+            # Raise ValueError if the query doesn't match any key in the database.
+            if query not in self.db:
+                return ValueError("The query doesn't match any key in the database")
+
+            # Return dictionary with files that match the query as keys and
+            # positions of the query in these files as values.
+            else:
+                return self.with_names(self.db[query])
+
+    def open_bitmaps(self):
+        '''
+        This method opens the bitmaps of the words written by ToIndex.
+        return@: the bitmaps or None if the database has none.
+        '''
+        try:
+            return shelve.open(self.db_name + '.bitmaps', 'r')
+        except dbm.error:
+            return None
+
+    def match_all(self, words):
+        '''
+        This method finds the files that contain all the words with the bitmaps,
+        without reading the positions. The bitmaps are united from the smallest
+        one, and the rest are not read as soon as no file is left.
+        param@ 'words': the words.
+        return@: a bitmap of the ids of the files or None if the database has no bitmaps.
+        '''
+        if self.bitmaps is None:
+            return None
+        with self.lock:
+            bitmaps = [self.bitmaps.get(word, 0) for word in set(words)]
+        bitmaps.sort(key=lambda bitmap: bitmap.bit_count())
+        result = bitmaps[0] if bitmaps else 0
+        for bitmap in bitmaps[1:]:
+            if not result:
+                break
+            result &= bitmap
+        return result
+
+    def expand(self, pattern, limit=MAX_EXPANSIONS):
+        '''
+        This method finds the words of the database that match a pattern.
+        Only the words starting with the part of the pattern before the first
+        '*' or '?' are checked, and they are found in the dictionary of the words
+        by binary search. The pattern must start with at least MIN_PREFIX letters,
+        and at most MAX_SCANNED words are checked.
+        param@ 'pattern': a word where '*' means any characters and '?' means one character.
+        param@ 'limit': the largest number of words to be found.
+        return@: a sorted list of at most 'limit' words.
+        '''
+        prefix = check_pattern(pattern)
+        regex = pattern_to_regex(pattern)
+        # The dictionary is only read, so the other threads are not blocked while it is checked.
+        with self.lock:
+            terms = self.terms
+        words = []
+        for scanned, word in enumerate(terms.iterate_prefix(prefix)):
+            if len(words) >= limit or scanned >= MAX_SCANNED:
+                break
+            if regex.fullmatch(word):
+                words.append(word)
+        return words
+
+    def get_bitmap(self, word):
+        '''
+        This method gets the bitmap of the ids of the files a word is in.
+        param@ 'word': the word.
+        return@: the bitmap, 0 if the word is not in the database.
+        '''
+        with self.lock:
+            if self.bitmaps is not None:
+                return self.bitmaps.get(word, 0)
+            # The database has no bitmaps, so it is made from the positions.
+            bitmap = 0
+            for doc_id in self.db.get(word, {}):
+                bitmap |= 1 << doc_id
+            return bitmap
+
+    def all_documents(self):
+        '''
+        This method gets the bitmap of all the files indexed by line.
+        '''
+        bitmap = 0
+        for doc_id in self.get_lengths()[0]:
+            bitmap |= 1 << doc_id
+        return bitmap
+
+    def match_phrase(self, words, candidates):
+        '''
+        This method finds the files that contain a phrase.
+        param@ 'words': the words of the phrase in their order.
+        param@ 'candidates': a bitmap of the files that contain all the words.
+        return@: a bitmap of the files that contain the phrase.
+        '''
+        postings = self.get_word_postings(words)
+        if postings is None:
+            return 0
+        result = 0
+        for doc_id in iterate_bits(candidates):
+            if self.match_positions('phrase', words, None, postings, doc_id):
+                result |= 1 << doc_id
+        return result
+
+    def with_names(self, results):
+        '''
+        This method replaces the ids of the files in the results with their names.
+        param@ 'results': a dictionary {file_id: positions}.
+        return@: a dictionary {file_name: positions} in the same order.
+        '''
+        with self.lock:
+            return dict((self.docs.get_name(doc_id), positions) for doc_id, positions in results.items())
+
+    def get_postings(self, query):
+        '''
+        This method looks up every word of a query in the database.
+        param@: a query
+        return@: a list of dictionaries {file_id: positions}, one for each
+        different word of the query, or None if some word is not in the database.
+        '''
+        # Create an object of ToTokenize().
+        tokenizer = ToTokenize()
+        postings = self.get_word_postings(word.wordform for word in tokenizer.tokenize_reduced(query))
+        if postings is None:
+            return None
+        return list(postings.values())
+
+    def get_word_postings(self, words, required=True):
+        '''
+        This method looks up words in the database.
+        param@ 'words': the words.
+        param@ 'required': if it is False, the words that are not in the database
+        are skipped instead of returning None.
+        return@: a dictionary {word: {file_id: positions}} for every different word
+        in the order of their first appearance, or None if some word is not in the database.
+        '''
+        # This dictionary will contain documents in which each word can
+        # be found.
+        postings = {}
+        for word in words:
+            # The positions of a repeated word are taken only once.
+            if word in postings:
+                continue
+            # If the query doesn't match any key in the database return None.
+            with self.lock:
+                files = self.db.get(word)
+            if files is None:
+                if not required:
+                    continue
+                return None
+            postings[word] = files
+        return postings
+
+    @staticmethod
+    def intersect(docs):
+        '''
+        This method finds the files that contain all the words of a query.
+        The files of the rarest word are checked first, and a file is dropped
+        as soon as one of the other words is not in it.
+        param@ 'docs': a list of dictionaries {file_id: positions}.
+        return@: a sorted list of file ids. The ids are given in the order
+        the files are indexed.
+        '''
+        if not docs:
+            return []
+        # Sort the words by the number of files they occur in.
+        docs = sorted(docs, key=len)
+        files = []
+        for doc_id in docs[0]:
+            for document in docs[1:]:
+                if doc_id not in document:
+                    break
+            else:
+                files.append(doc_id)
+        files.sort()
+        return files
+
+    @staticmethod
+    def merge_positions(docs, doc_id):
+        '''
+        This method merges the positions of all words of a query in a file.
+        The positions of each word are already sorted, so they are merged
+        with a heap instead of being sorted again.
+        param@ 'docs': a list of dictionaries {file_id: positions}.
+        param@ 'doc_id': the id of the file.
+        return@: a list of positions sorted by line and start.
+        '''
+        return list(heapq.merge(*[document[doc_id] for document in docs], key=position_key))
+
+    @staticmethod
+    def match_positions(kind, words, distance, postings, doc_id):
+        '''
+        This method finds the phrases or the close words of a query in a file.
+        param@ 'kind': 'phrase' or 'near', see parse_query().
+        param@ 'words': the words of the query in their order.
+        param@ 'distance': the largest distance between the words for 'near'.
+        param@ 'postings': a dictionary {word: {file_id: positions}}.
+        param@ 'doc_id': the id of the file.
+        return@: a list of positions of the matched places.
+        '''
+        for word in postings:
+            if not getattr(postings[word][doc_id], 'ordinals', False):
+                raise ValueError('The files were indexed without the numbers of the words, index them again')
+        if kind == 'phrase':
+            return find_phrases([postings[word][doc_id] for word in words])
+        return find_near([postings[word][doc_id] for word in postings], distance)
+
+    def find_documents(self, query):
+        '''
+        This method finds the files that match a query and keeps
+        the positions of the words in each of them.
+        For a phrase or a NEAR/k query (see parse_query()) only the files where
+        the words are found together are kept, with the positions of the matched places.
+        A boolean query is evaluated by find_boolean().
+        The result is cached. The key of the cache of a simple query is the set
+        of the words, so the queries that differ only in the order or repetition
+        of the words share the result.
+        param@: a query
+        return@: a sorted list of file ids, a dictionary with file ids
+        as keys and lists of positions of each word (or of the matched places) as values,
+        and the number of files each word (or the whole phrase) is found in.
+        '''
+        kind, words, distance = parse_query(query)
+        if not words and kind != 'boolean':
+            return [], {}, []
+        if kind == 'all':
+            key = tuple(sorted(set(words)))
+        elif kind == 'boolean':
+            key = (kind, query)
+        else:
+            key = (kind, distance, tuple(words))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        if kind == 'boolean':
+            return self.find_boolean(query, key)
+        candidates = self.match_all(words)
+        # The positions are read only if some files contain all the words.
+        postings = self.get_word_postings(words) if candidates != 0 else None
+        docs = list(postings.values()) if postings else []
+        if candidates is None:
+            files = self.intersect(docs)
+        elif docs:
+            files = list(iterate_bits(candidates))
+        else:
+            files = []
+        matched = {}
+        size = FILE_SIZE
+        for doc_id in files:
+            if kind == 'all':
+                matched[doc_id] = [document[doc_id] for document in docs]
+            else:
+                spans = self.match_positions(kind, words, distance, postings, doc_id)
+                if not spans:
+                    continue
+                matched[doc_id] = [spans]
+            size += FILE_SIZE + POSITION_SIZE * sum(len(positions) for positions in matched[doc_id])
+        files = [doc_id for doc_id in files if doc_id in matched]
+        if kind == 'all':
+            frequencies = [len(document) for document in docs]
         else:
-            return self.db[query]
+            frequencies = [len(files)]
+        self.cache.put(key, (files, matched, frequencies), size)
+        return files, matched, frequencies
+
+    def find_boolean(self, query, key):
+        '''
+        This method finds the files that match a boolean query. The files are
+        found with the bitmaps, and the positions of the words are read only
+        if some files match. The result is cached in the same way as in find_documents().
+        param@ 'query': a boolean query.
+        param@ 'key': the key of the cache.
+        return@: the same as find_documents(), with a list of positions for each
+        word and phrase of the query. The list of positions of a word that is
+        not in a file is empty. A phrase has the positions of the places where
+        it is found, and the number of the matched files it is found in.
+        '''
+        tree = QueryParser(self.expand).parse(query)
+        # The words and the phrases, which are tuples of words.
+        items = list(dict.fromkeys(tree.words()))
+        words = list(dict.fromkeys(word for item in items for word in ((item,) if isinstance(item, str) else item)))
+        candidates = tree.evaluate(Evaluation(self))
+        postings = self.get_word_postings(words, required=False) if candidates and words else {}
+        files = list(iterate_bits(candidates))
+        matched = {}
+        size = FILE_SIZE
+        for doc_id in files:
+            matched[doc_id] = []
+            for item in items:
+                if isinstance(item, str):
+                    matched[doc_id].append(postings[item].get(doc_id, []) if item in postings else [])
+                elif all(word in postings and doc_id in postings[word] for word in item):
+                    phrase_postings = dict((word, postings[word]) for word in item)
+                    matched[doc_id].append(self.match_positions('phrase', list(item), None, phrase_postings, doc_id))
+                else:
+                    matched[doc_id].append([])
+            size += FILE_SIZE + POSITION_SIZE * sum(len(positions) for positions in matched[doc_id])
+        frequencies = []
+        for number, item in enumerate(items):
+            if isinstance(item, str):
+                frequencies.append(len(postings.get(item, ())))
+            else:
+                frequencies.append(sum(1 for doc_id in files if matched[doc_id][number]))
+        self.cache.put(key, (files, matched, frequencies), size)
+        return files, matched, frequencies
+
+    def get_lengths(self):
+        '''
+        This method gets the numbers of words of the files recorded by ToIndex.
+        They are kept in the cache, so they are read again only after
+        the database is changed.
+        return@: a dictionary {file_id: number of words} and the average number.
+        '''
+        cached = self.cache.get(LENGTHS_KEY)
+        if cached is not None:
+            return cached
+        try:
+            lengths_db = shelve.open(self.db_name + '.lengths', 'r')
+        except dbm.error:
+            # The database was created before the numbers were recorded.
+            lengths = {}
+        else:
+            # The keys of a shelve are strings.
+            lengths = dict((int(key) if key.isdigit() else key, length) for key, length in lengths_db.items())
+            lengths_db.close()
+        average = sum(lengths.values()) / len(lengths) if lengths else 1
+        self.cache.put(LENGTHS_KEY, (lengths, average), FILE_SIZE * (len(lengths) + 1))
+        return lengths, average
+
+    def rank(self, files, matched, frequencies, limit):
+        '''
+        This method finds the best files by BM25. Only 'limit' files are kept
+        in a heap, so the files are not sorted all together.
+        param@ 'files': the ids of the files sorted in the order of indexing.
+        param@ 'matched': a dictionary with file ids as keys and lists
+        of positions of each word as values.
+        param@ 'frequencies': the number of files each word is found in.
+        param@ 'limit': the number of files to be returned.
+        return@: a list of file ids from the best to the worst. The files
+        with the same score are in the order of indexing.
+        '''
+        if limit <= 0 or not files:
+            return []
+        lengths, average = self.get_lengths()
+        total = max(len(lengths), max(frequencies, default=0))
+        weights = [math.log(1 + (total - frequency + 0.5) / (frequency + 0.5)) for frequency in frequencies]
+        heap = []
+        for index, doc_id in enumerate(files):
+            norm = K1 * (1 - B + B * lengths.get(doc_id, average) / average)
+            score = 0.0
+            for word, weight in enumerate(weights):
+                # The number of positions is known without decoding them.
+                count = len(matched[doc_id][word])
+                score += weight * count * (K1 + 1) / (count + norm)
+            # The earlier file wins if the scores are equal.
+            entry = (score, -index, doc_id)
+            if len(heap) < limit:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+        return [doc_id for score, index, doc_id in sorted(heap, reverse=True)]
 
     def multi_search(self, query):
         '''
         This method performs search for a multiple words query.
+        A phrase in double quotes or a query with NEAR/k gives
+        only the positions of the places where the words are found together.
+        A query with AND, OR, NOT and parentheses gives the files that match it
+        and the positions of the words that are not under NOT. A pattern
+        like 'Андре*' is replaced by at most MAX_EXPANSIONS words that match it.
         param@: a query
         return@: a dictionary with file names in which the words of the query
         are present and list of positions of the words of a query as values.
@@ -51,58 +638,41 @@ class SearchEngine:
         # Raise ValueError if the query is an empty string.
         if query == "":
             raise ValueError('Empty query')        
-        # Create an object of ToTokenize().
-        tokenizer = ToTokenize()        
-        # Chunk the query into tokens and write the list of them into
-        # the variable 'query'.
-        query = tokenizer.tokenize_reduced(query)        
-        # This list will contain documents in which the current word can
-        # be found.
-        docs = []
-        for word in query:        
-            # If the query doesn't match any key in the database return an empty dictionary.
-            if word.wordform not in self.db:
-                return {}            
-            # Append dictionary {doc_name: positions} in 'docs' for each word of the query.
-            docs.append(self.search(word.wordform))
-        # Turn the first document name from the list 'docs' to a set and write it to 'files'.
-        files = set(docs[0])
-        
-        for document in docs[1:]:
-            
-            # Each following document from 'docs' turn to a set too 
-            # and intersect it with 'files'.
-            files &= set(document)
-            
+        # Phrases, close words and boolean queries are found by find_documents().
+        if parse_query(query)[0] != 'all':
+            files, matched, frequencies = self.find_documents(query)
+            return self.with_names(dict((doc_id, list(heapq.merge(*matched[doc_id], key=position_key)))
+                                        for doc_id in files))
+        tokenizer = ToTokenize()
+        candidates = self.match_all(word.wordform for word in tokenizer.tokenize_reduced(query))
+        # If no file contains all the words, the positions are not read.
+        if candidates == 0:
+            return {}
+        docs = self.get_postings(query)
+        # If the query doesn't match any key in the database return an empty dictionary.
+        if not docs:
+            return {}
         # This dictionary will be returned.
         result = {}
-        
-        # For each file name in the set 'files'
-        for file_name in files:
-            
-            # For each dict in the list 'docs' create a key-value pair in a
-            # dictionary 'result' with a file name as a key and an empty list as a key.
-            # Than we extend the empty list with an array of the positions of the word in
-            # this file.
-            for dictionary in docs:
-                result.setdefault(file_name, []).extend(dictionary[file_name])
-            # Sort the result so that the lines and the positions are
-            # in the ascending order.
-            result[file_name].sort()              
-        return result
+        files = self.intersect(docs) if candidates is None else iterate_bits(candidates)
+        # For each file that contains all the words merge their positions.
+        for doc_id in files:
+            result[doc_id] = self.merge_positions(docs, doc_id)
+        return self.with_names(result)
  
-    def limited_multi_search(self, query, doclimit, docoffset):
+    def limited_multi_search(self, query, doclimit, docoffset, ranked=True):
         '''
         This method performs multi-word search and returns a limited number
         of documents containing it.
         param@ 'query': a query.
         param@ 'doclimit': a number of documents to be returned.
         param@ 'docoffset': a number of the first document to be returned.
+        param@ 'ranked': if it is True, the best documents by BM25 come first,
+        otherwise the documents are in the order of their names, like the volumes.
         return@: a dictionary with file names in which the words of the query
         are present and list of positions of the words of a query as values.
+        The order of the dictionary is the order of the documents.
         '''
-        if docoffset < 0:
-            docoffset = 0        
         # Raise TypeError if the input type is not string 
         if not isinstance(query, str):
             raise TypeError        
@@ -115,46 +685,23 @@ class SearchEngine:
         # Raise ValueError if the docoffset is not int.
         if not isinstance(docoffset, int):
             raise TypeError        
-        # Create an object of ToTokenize().
-        tokenizer = ToTokenize()        
-        # Chunk the query into tokens and write the list of them into
-        # the variable 'query'.
-        query = tokenizer.tokenize_reduced(query)        
-        # This list will contain documents in which the current word can
-        # be found.
-        docs = []
-        for word in query:        
-            # If the query doesn't match any key in the database return an empty dictionary.
-            if word.wordform not in self.db:
-                return {}           
-            # Append dictionary {doc_name: positions} in 'docs' for each word of the query.
-            docs.append(self.search(word.wordform))                                
-        # Turn the first document name from the list 'docs' to a set and write it to 'files'.
-        files = set(docs[0])        
-        for document in docs[1:]:            
-            # Each following document from 'docs' turn to a set too 
-            # and intersect it with 'files'.
-            files &= set(document)
+        if docoffset < 0:
+            docoffset = 0        
+        # Get all the files that contain the query, possibly from the cache.
+        files, matched, frequencies = self.find_documents(query)
+        # Only the files of the required page are taken and only their positions are merged.
+        if ranked:
+            page = self.rank(files, matched, frequencies, docoffset + doclimit)[docoffset:]
+        else:
+            # Only the names of the page and the ones before it are kept sorted.
+            with self.lock:
+                page = heapq.nsmallest(docoffset + doclimit, files, key=self.docs.get_name)[docoffset:]
         # This dictionary will be returned.
         result = {}
-        # Sorting file names in the chronological order.
-        sorted_file_names = sorted(files)
-        # Iterating through the file names.
-        for i, file_name in enumerate(sorted_file_names):
-            # Exit the cycle if 'i' is out of limit.
-            if i >= docoffset + doclimit:
-                break
-            if i >= docoffset:
-                # For each dict in the list 'docs' create a key-value pair in a
-                # dictionary 'result' with a file name as a key and an empty list as a key.
-                # Than we extend the empty list with an array of the positions of the word in
-                # this file.
-                for dictionary in docs:
-                    result.setdefault(file_name, []).extend(dictionary[file_name])
-                # Sort the result so that the lines and the positions are
-                # in the ascending order.
-                result[file_name].sort()              
-        return result
+        for doc_id in page:
+            result[doc_id] = list(heapq.merge(*matched[doc_id], key=position_key))
+        # Only the files of the page get their names.
+        return self.with_names(result)
             
 
 if __name__ == '__main__':
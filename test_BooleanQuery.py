@@ -0,0 +1,76 @@
+import unittest
+from boolean_query import QueryParser, is_boolean
+
+class TestQueryParser(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        Create a parser of boolean queries.
+        '''
+        self.parser = QueryParser()
+
+    def test_wrong_input(self):
+        '''
+        Test that TypeError is raised if the query is not a string.
+        '''
+        with self.assertRaises(TypeError):
+            self.parser.parse(12)
+
+    def test_is_boolean(self):
+        '''
+        Test that a query is boolean only if it has an operator
+        or a parenthesis outside the phrases.
+        '''
+        self.assertTrue(is_boolean('мама OR папа'))
+        self.assertTrue(is_boolean('(мама папа)'))
+        self.assertFalse(is_boolean('мама папа'))
+        self.assertFalse(is_boolean('"мама OR папа"'))
+        self.assertFalse(is_boolean('мама or папа'))
+
+    def test_precedence(self):
+        '''
+        Test that AND binds stronger than OR, that the words without
+        an operator are joined by AND and that the parentheses group operands.
+        '''
+        self.assertEqual(repr(self.parser.parse('мама OR папа мыла')), '(мама OR (папа AND мыла))')
+        self.assertEqual(repr(self.parser.parse('(мама OR папа) AND мыла')), '((мама OR папа) AND мыла)')
+        self.assertEqual(repr(self.parser.parse('мама AND (мыла раму)')), '(мама AND мыла AND раму)')
+        self.assertEqual(repr(self.parser.parse('мама NOT "мыла раму"')), '(мама AND NOT "мыла раму")')
+
+    def test_words(self):
+        '''
+        Test that the words under NOT are not shown and that a phrase is given as a whole.
+        '''
+        self.assertEqual(self.parser.parse('мама OR папа NOT раму').words(), ['мама', 'папа'])
+        self.assertEqual(self.parser.parse('"мыла раму" OR мама').words(), [('мыла', 'раму'), 'мама'])
+
+    def test_patterns(self):
+        '''
+        Test that a pattern makes a query boolean and is replaced
+        by the words given by the function 'expand'.
+        '''
+        self.assertTrue(is_boolean('Андре*'))
+        self.assertTrue(is_boolean('Андр?й Болконский'))
+        self.assertFalse(is_boolean('Андре? Болконский'))
+        self.assertFalse(is_boolean('"Андре*"'))
+        self.assertFalse(is_boolean('кто виноват?'))
+        self.assertFalse(is_boolean('кто виноват ?'))
+        self.assertTrue(is_boolean('?ндрей'))
+        with self.assertRaises(ValueError):
+            self.parser.parse('Андре*')
+        parser = QueryParser(lambda pattern: {'Андре*': ['андрей', 'андрея'], 'кня?ь': ['князь']}.get(pattern, []))
+        self.assertEqual(repr(parser.parse('Андре* NOT кня?ь')), '((андрей OR андрея) AND NOT князь)')
+        self.assertEqual(parser.parse('Пьер*').words(), [])
+        self.assertEqual(repr(parser.parse('Андре*? OR князь?')), '((андрей OR андрея) OR князь)')
+
+    def test_wrong_query(self):
+        '''
+        Test that ValueError is raised if the query can't be parsed.
+        '''
+        for query in ['(мама OR папа', 'мама OR', 'мама )', 'NOT', '""', '( )']:
+            with self.assertRaises(ValueError):
+                self.parser.parse(query)
+
+
+if __name__ == '__main__':
+    unittest.main()
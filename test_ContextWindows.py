@@ -6,6 +6,9 @@ from context_windows import ContextWindow
 from context_windows import Contexter
 from indexation import ToIndex
 from indexation import PositionByLine
+from query_cache import LRUCache
+import document_store
+from document_store import DocumentStore
 
 class TestContexter(unittest.TestCase):
 
@@ -30,14 +33,16 @@ class TestContexter(unittest.TestCase):
         indexer.index_by_line('test_text2.txt')
         indexer.index_by_line('test_text3.txt')
 
-        del indexer
+        indexer.close()
         self.search = SearchEngine('database')
         
     def tearDown(self):
         '''
         In this method we destroy an object of SearchEngine(),
         delete 'database' and text file.
+        The mapped files are forgotten, because the next test writes them again.
         '''
+        document_store.documents.clear()
         del self.search
         files = os.listdir()
         for single_file in files:
@@ -118,6 +123,19 @@ class TestContexter(unittest.TestCase):
         self.assertEqual(ref_cw, actual_cw)
 
  
+    def test_file_windows_are_same_as_single_windows(self):
+        '''
+        Test that windows created for all positions of a file at once are
+        the same as windows created one by one, and that they are sorted by line.
+        '''
+        window_size = 1
+        positions = [PositionByLine(15, 19, 0), PositionByLine(10, 14, 0), PositionByLine(20, 24, 0)]
+        actual_cws = self.get_cw.get_file_cws(window_size, 'test_text.txt', positions)
+        ref_cws = [self.get_cw.get_one_cw(window_size, 'test_text.txt', PositionByLine(10, 14, 0)),
+                   self.get_cw.get_one_cw(window_size, 'test_text.txt', PositionByLine(15, 19, 0)),
+                   self.get_cw.get_one_cw(window_size, 'test_text.txt', PositionByLine(20, 24, 0))]
+        self.assertEqual(ref_cws, actual_cws)
+
     def test_windows_are_united_correctly(self):        
         '''
         Test that two context windows are united correctly.
@@ -130,6 +148,22 @@ class TestContexter(unittest.TestCase):
         united_cws = self.get_cw.unite_windows(window1, window2)
         ref_united_cws = [([PositionByLine(10, 14, 0), PositionByLine(15, 19, 0)], 7, 23, 'ooh la la мама мыла раму123  frf34')]
 
+    def test_chain_of_windows_is_united(self):
+        '''
+        Test that a chain of intersected windows becomes one window,
+        whatever the order of the windows, and that the windows of different lines
+        with the same text are not united.
+        '''
+        line = 'мама мыла мама мыла'
+        windows = [ContextWindow([PositionByLine(10, 14, 0)], 5, 19, line),
+                   ContextWindow([PositionByLine(0, 4, 0)], 0, 9, line),
+                   ContextWindow([PositionByLine(5, 9, 0)], 0, 14, line),
+                   ContextWindow([PositionByLine(0, 4, 1)], 0, 9, line)]
+        united_cws = self.get_cw.unite_cws(windows)
+        ref_united_cws = [ContextWindow([PositionByLine(0, 4, 0), PositionByLine(5, 9, 0), PositionByLine(10, 14, 0)], 0, 19, line),
+                          ContextWindow([PositionByLine(0, 4, 1)], 0, 9, line)]
+        self.assertEqual(ref_united_cws, united_cws)
+
     def test_windows_are_extended_correctly(self): 
         '''
         Test that we context window is extended correctly.
@@ -138,6 +172,44 @@ class TestContexter(unittest.TestCase):
         actual_cw = self.get_cw.get_extended_cws(self.search.multi_search('мама мыла'), window_size)
         ref_cw = {'test_text.txt' :[([PositionByLine(10, 14, 0), PositionByLine(15, 19, 0)], 0, 33, 'ooh la la мама мыла раму123  frf34')]}
 
+    def test_window_is_extended_to_sentence(self):
+        '''
+        Test that a window is extended to the end of the previous sentence
+        and to the end of its own sentence.
+        '''
+        line = 'Мама мыла раму. Папа мыл окно! А я спал'
+        window = ContextWindow([PositionByLine(21, 24, 0)], 16, 29, line)
+        window.extend_to_sentence()
+        self.assertEqual((window.left_cont, window.right_cont), (16, 30))
+        window = ContextWindow([PositionByLine(5, 9, 0)], 5, 20, line)
+        window.extend_to_sentence([15, 30])
+        self.assertEqual((window.left_cont, window.right_cont), (0, 30))
+        window = ContextWindow([PositionByLine(33, 34, 0)], 33, 34, line)
+        window.extend_to_sentence([15, 30])
+        self.assertEqual(line[window.left_cont:window.right_cont], 'А я спал')
+
+    def test_extended_windows_use_indexed_sentences(self):
+        '''
+        Test that the extended windows are the same with the ends of the sentences
+        recorded by ToIndex and with the ends found in the lines.
+        '''
+        text = open('test_text4.txt', 'w')
+        text.write('Папа спал. И мама мыла раму! А я спал?\nНе спал. Ну мама снова мыла')
+        text.close()
+        indexer = ToIndex('database')
+        indexer.index_by_line('test_text4.txt')
+        indexer.close()
+        self.search.reload()
+        search_results = self.search.multi_search('мама мыла')
+        store = DocumentStore('database')
+        indexed_result = Contexter(store).get_extended_cws(search_results, 1)
+        store.get_document('test_text4.txt').sentences = None
+        found_result = Contexter(store).get_extended_cws(search_results, 1)
+        self.assertEqual(indexed_result, found_result)
+        self.assertEqual([cw.line[cw.left_cont:cw.right_cont] for cw in indexed_result['test_text4.txt']],
+                         ['И мама мыла раму!', 'Ну мама снова мыла'])
+        os.remove('test_text4.txt')
+
     def test_windows_are_bolded_correctly(self):
         '''
         Test that words are made bold correctly.
@@ -146,6 +218,23 @@ class TestContexter(unittest.TestCase):
         actual_cw = self.get_cw.get_bold_cws(self.search.multi_search('мама мыла'), window_size)
         ref_cw = {'test_text.txt' :[([PositionByLine(10, 14, 0), PositionByLine(15, 19, 0)], 7, 23, 'la <b>мама</b> <b>мыла</b> раму')]}
 
+    def test_make_bold(self):
+        '''
+        Test that the words are made bold with different markups,
+        that overlapping words are made bold once and that the line is not changed.
+        '''
+        line = 'ooh la la мама мыла раму123  frf34'
+        window = ContextWindow([PositionByLine(15, 19, 0), PositionByLine(10, 14, 0)], 7, 24, line)
+        self.assertEqual(window.make_bold(), 'la <b>мама</b> <b>мыла</b> раму')
+        self.assertEqual(window.make_bold(), 'la <b>мама</b> <b>мыла</b> раму')
+        self.assertEqual(window.line, line)
+        self.assertEqual(window.highlighted, 'la <b>мама</b> <b>мыла</b> раму')
+        self.assertEqual(window.make_bold('ansi'), 'la \033[1mмама\033[0m \033[1mмыла\033[0m раму')
+        self.assertEqual(window.make_bold('plain'), 'la [мама] [мыла] раму')
+        self.assertEqual(window.make_bold(('*', '*')), 'la *мама* *мыла* раму')
+        window = ContextWindow([PositionByLine(10, 16, 0), PositionByLine(12, 19, 0), PositionByLine(20, 27, 0)], 7, 24, line)
+        self.assertEqual(window.make_bold(), 'la <b>мама мыла</b> <b>раму</b>')
+
     def test_limited_bold_windows_runs_ok(self):
         '''
         Test that the programs runs fine provided the input of the correct type.
@@ -159,6 +248,68 @@ class TestContexter(unittest.TestCase):
         'test_text2.txt': [([PositionByLine(0, 4, 0), PositionByLine(5, 9, 0)], 0, 9, '<b>мама</b> <b>мыла</b> окно')],
         'test_text3.txt': [([PositionByLine(0, 4, 0), PositionByLine(5, 9, 0)], 0, 9, '<b>мама</b> <b>мыла</b> еще что-нибудь')]}
         
+    def test_bold_windows_are_cached(self):
+        '''
+        Test that the bold quotes are the same with the snippet cache
+        and that they are taken from it the second time.
+        '''
+        cache = LRUCache(1024 * 1024)
+        cached_contexter = Contexter(snippet_cache=cache)
+        search_results = self.search.multi_search('мама мыла')
+        lim_of_pairs = [(0, 1), (0, 1), (0, 1)]
+        ref_result = self.get_cw.get_bold_cws_limited(search_results, 1, 3, 0, lim_of_pairs)
+        first_result = cached_contexter.get_bold_cws_limited(search_results, 1, 3, 0, lim_of_pairs)
+        hits = cache.hits
+        second_result = cached_contexter.get_bold_cws_limited(search_results, 1, 3, 0, lim_of_pairs)
+        self.assertEqual(ref_result, first_result)
+        self.assertEqual(ref_result, second_result)
+        self.assertEqual(first_result['test_text.txt'], ['la <b>мама</b> <b>мыла</b> раму'])
+        self.assertGreater(cache.hits, hits)
+        # A quote evicted from the cache is created again from its positions.
+        cache.entries.pop(('test_text2.txt', 0, ((0, 4, 0), (5, 9, 0)), 1, 'bold', 'html'))
+        self.assertEqual(second_result, cached_contexter.get_bold_cws_limited(search_results, 1, 3, 0, lim_of_pairs))
+
+    def test_bold_windows_are_paginated_lazily(self):
+        '''
+        Test that every document on the page gets its own pair of offset and limit
+        and that the lines after the last required quote are not read.
+        '''
+        text = open('test_text4.txt', 'w')
+        for num in range(50):
+            text.write('мама номер %s\n' % num)
+        text.close()
+        indexer = ToIndex('database')
+        indexer.index_by_line('test_text4.txt')
+        indexer.close()
+        self.search.reload()
+        read_lines = []
+        get_line = self.get_cw.store.get_line
+        def counting_get_line(file_path, line_num):
+            read_lines.append((file_path, line_num))
+            return get_line(file_path, line_num)
+        self.get_cw.store.get_line = counting_get_line
+        search_results = self.search.multi_search('мама')
+        actual_result = self.get_cw.get_bold_cws_limited(search_results, 2, 2, 2, [(2, 2), (5, 1)])
+        self.assertEqual(actual_result, {'test_text3.txt': [],
+                                         'test_text4.txt': ['<b>мама</b> номер 5']})
+        # One more line is read to find out that the last quote doesn't continue.
+        self.assertEqual([line_num for file_name, line_num in read_lines if file_name == 'test_text4.txt'],
+                         [0, 1, 2, 3, 4, 5, 6])
+        # The next pages of the cached quotes don't read the previous lines again.
+        cached_contexter = Contexter(snippet_cache=LRUCache(1024 * 1024))
+        first_page = cached_contexter.get_bold_cws_limited(search_results, 2, 1, 3, [(0, 2)])
+        self.assertEqual(first_page, {'test_text4.txt': ['<b>мама</b> номер 0', '<b>мама</b> номер 1']})
+        read_lines.clear()
+        cached_contexter.store.get_line = counting_get_line
+        second_page = cached_contexter.get_bold_cws_limited(search_results, 2, 1, 3, [(2, 2)])
+        self.assertEqual(second_page, {'test_text4.txt': ['<b>мама</b> номер 2', '<b>мама</b> номер 3']})
+        self.assertEqual(read_lines, [('test_text4.txt', 2), ('test_text4.txt', 3), ('test_text4.txt', 4)])
+        # The quotes known for a query are found without the positions.
+        cached_contexter.get_bold_cws_limited(search_results, 2, 1, 3, [(0, 2)], 'мама')
+        empty_results = dict((file_name, []) for file_name in search_results)
+        self.assertEqual(cached_contexter.get_bold_cws_limited(empty_results, 2, 1, 3, [(0, 2)], 'мама'), first_page)
+        os.remove('test_text4.txt')
+
     def test_limited_bold_windows_wrong_input(self):
         '''
         Test that TypeError is raised if the input is of the wrong type.
@@ -0,0 +1,157 @@
+import os
+import unittest
+from unittest import mock
+from indexation import ToIndex
+from indexation import PositionByLine
+from indexation import find_sentence_ends
+import document_store
+from document_store import DocumentStore
+from context_windows import Contexter
+from context_windows import ContextWindow
+
+class TestDocumentStore(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        Create a text file with several lines and index it.
+        '''
+        text = open('test_text.txt', 'w')
+        text.write('мама мыла раму\n')
+        text.write('\n')
+        text.write('ooh la la мама мыла раму123  frf34\n')
+        text.write('да')
+        text.close()
+        indexer = ToIndex('database')
+        indexer.index_by_line('test_text.txt')
+        indexer.close()
+        self.store = DocumentStore('database')
+
+    def tearDown(self):
+        '''
+        In this method we destroy the store, delete 'database' and the text file.
+        The mapped files are forgotten, because the next test writes them again.
+        '''
+        del self.store
+        document_store.documents.clear()
+        files = os.listdir()
+        for single_file in files:
+            if single_file == "database" or single_file.startswith('database.'):
+                os.remove(single_file)
+        os.remove('test_text.txt')
+
+    def test_wrong_input_type(self):
+        '''
+        Test that TypeError is raised if the input is of the wrong type.
+        '''
+        with self.assertRaises(TypeError):
+            self.store.get_line(42, 0)
+        with self.assertRaises(TypeError):
+            self.store.get_line('test_text.txt', '0')
+
+    def test_line_does_not_exist(self):
+        '''
+        Test that IndexError is raised if there is no such line in the file.
+        '''
+        with self.assertRaises(IndexError):
+            self.store.get_line('test_text.txt', 4)
+
+    def test_get_line(self):
+        '''
+        Test that the lines are got by their numbers.
+        '''
+        self.assertEqual(self.store.get_line('test_text.txt', 2), 'ooh la la мама мыла раму123  frf34\n')
+        self.assertEqual(self.store.get_line('test_text.txt', 0), 'мама мыла раму\n')
+        self.assertEqual(self.store.get_line('test_text.txt', 1), '\n')
+        self.assertEqual(self.store.get_line('test_text.txt', 3), 'да')
+
+    def test_store_without_database(self):
+        '''
+        Test that a store without a database gets the same lines.
+        '''
+        store = DocumentStore()
+        for num in range(4):
+            self.assertEqual(store.get_line('test_text.txt', num), self.store.get_line('test_text.txt', num))
+
+    def test_contexter_uses_store(self):
+        '''
+        Test that a context window is created from the line got by the store.
+        '''
+        contexter = Contexter(self.store)
+        actual_cw = contexter.get_one_cw(1, 'test_text.txt', PositionByLine(10, 14, 2))
+        ref_cw = ContextWindow([PositionByLine(10, 14, 2)], 7, 19, 'ooh la la мама мыла раму123  frf34\n')
+        self.assertEqual(ref_cw, actual_cw)
+
+    def test_get_sentence_ends(self):
+        '''
+        Test that the ends of the sentences recorded by ToIndex are the same
+        as the ends found in the lines.
+        '''
+        text = open('test_text.txt', 'w')
+        text.write('Мама мыла раму. Папа мыл окно!\n\nА я спал? Да. Нет\n')
+        text.close()
+        indexer = ToIndex('database')
+        indexer.index_by_line('test_text.txt')
+        indexer.close()
+        store = DocumentStore()
+        self.store = DocumentStore('database')
+        self.assertIsNotNone(self.store.get_document('test_text.txt').sentences)
+        for num in range(3):
+            self.assertEqual(list(self.store.get_sentence_ends('test_text.txt', num)),
+                             list(find_sentence_ends(store.get_line('test_text.txt', num))))
+        self.assertEqual(list(self.store.get_sentence_ends('test_text.txt', 0)), [15, 30])
+        self.assertEqual(list(self.store.get_sentence_ends('test_text.txt', 1)), [])
+        with self.assertRaises(IndexError):
+            self.store.get_sentence_ends('test_text.txt', 3)
+
+    def test_reload_reopens_the_database(self):
+        '''
+        Test that after reload() the store uses the offsets and the ends
+        of the sentences recorded when the file was indexed again.
+        '''
+        self.assertEqual(list(self.store.get_sentence_ends('test_text.txt', 0)), [])
+        text = open('test_text.txt', 'w')
+        text.write('Мама мыла раму. Папа мыл окно!\n')
+        text.close()
+        indexer = ToIndex('database')
+        indexer.index_by_line('test_text.txt')
+        indexer.close()
+        self.store.reload()
+        self.assertEqual(list(self.store.get_document('test_text.txt').offsets), [0, os.path.getsize('test_text.txt')])
+        self.assertEqual(list(self.store.get_sentence_ends('test_text.txt', 0)), [15, 30])
+
+    def test_file_is_mapped_once(self):
+        '''
+        Test that different stores share the same mapped file.
+        '''
+        store = DocumentStore()
+        self.assertIs(store.get_document('test_text.txt'), self.store.get_document('test_text.txt'))
+
+    def test_changed_file_is_mapped_again(self):
+        '''
+        Test that the store notices that a file was changed.
+        '''
+        self.store.get_line('test_text.txt', 0)
+        text = open('test_text.txt', 'w')
+        text.write('окно\nмыла')
+        text.close()
+        with mock.patch('document_store.CHECK_INTERVAL', 0):
+            self.assertEqual(self.store.get_line('test_text.txt', 1), 'мыла')
+            with self.assertRaises(IndexError):
+                self.store.get_line('test_text.txt', 2)
+
+    def test_file_is_not_checked_for_every_line(self):
+        '''
+        Test that a mapped file is not checked again within CHECK_INTERVAL seconds
+        and that it is checked again after reload().
+        '''
+        self.store.get_line('test_text.txt', 0)
+        with mock.patch('os.stat', side_effect=AssertionError):
+            self.assertEqual(self.store.get_line('test_text.txt', 3), 'да')
+        text = open('test_text.txt', 'w')
+        text.write('окно\nмыла')
+        text.close()
+        self.store.reload()
+        self.assertEqual(self.store.get_line('test_text.txt', 1), 'мыла')
+
+if __name__ == '__main__':
+    unittest.main()
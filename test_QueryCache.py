@@ -0,0 +1,75 @@
+import time
+import unittest
+import query_cache
+from query_cache import LRUCache
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        Create a cache for values with the total size of 10.
+        '''
+        self.cache = LRUCache(10)
+
+    def test_wrong_input(self):
+        '''
+        Test that TypeError is raised if the size of the cache is not int.
+        '''
+        with self.assertRaises(TypeError):
+            LRUCache('10')
+
+    def test_hits_and_misses(self):
+        '''
+        Test that hits and misses are counted.
+        '''
+        self.assertIsNone(self.cache.get('мама'))
+        self.cache.put('мама', [1, 2], 2)
+        self.assertEqual(self.cache.get('мама'), [1, 2])
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'evictions': 0,
+                                              'entries': 1, 'size': 2})
+
+    def test_least_recently_used_is_evicted(self):
+        '''
+        Test that the least recently used values are evicted when the cache is full.
+        '''
+        self.cache.put('мама', 1, 4)
+        self.cache.put('мыла', 2, 4)
+        self.cache.get('мама')
+        self.cache.put('раму', 3, 4)
+        self.assertIsNone(self.cache.get('мыла'))
+        self.assertEqual(self.cache.get('мама'), 1)
+        self.assertEqual(self.cache.get('раму'), 3)
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertEqual(self.cache.size, 8)
+
+    def test_too_big_value_is_not_stored(self):
+        '''
+        Test that a value bigger than the cache is not stored.
+        '''
+        self.cache.put('мама', 1, 11)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_old_values_expire(self):
+        '''
+        Test that a value older than the time to live is not returned.
+        '''
+        cache = LRUCache(10, ttl=0.01)
+        cache.put('мама', 1, 1)
+        self.assertEqual(cache.get('мама'), 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('мама'))
+        self.assertEqual(cache.size, 0)
+
+    def test_invalidate(self):
+        '''
+        Test that the registered caches of a database are cleared.
+        '''
+        self.cache.put('мама', 1, 1)
+        query_cache.register('database', self.cache)
+        query_cache.invalidate('another_database')
+        self.assertEqual(len(self.cache), 1)
+        query_cache.invalidate('database')
+        self.assertEqual(len(self.cache), 0)
+
+if __name__ == '__main__':
+    unittest.main()
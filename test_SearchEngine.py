@@ -1,6 +1,7 @@
 import shelve
 import os
 import unittest
+from unittest import mock
 from search_engine import SearchEngine
 from indexation import ToIndex
 from indexation import PositionByLine
@@ -20,7 +21,7 @@ class TestSearchEngine(unittest.TestCase):
         text.write('mama мыла ramu')
         text.close()
         indexer.index_by_line('test_text.txt')
-        del indexer
+        indexer.close()
         self.search_eng = SearchEngine('database')
 
     def tearDown(self):
@@ -63,6 +64,32 @@ class TestSearchEngine(unittest.TestCase):
         ref_dict = {'test_text.txt': [PositionByLine(5, 9, 0)]}
         self.assertEqual(ref_dict, search_res)
         
+    def test_reload_shows_new_files(self):
+        '''
+        Test that a reloaded engine finds the files indexed after it was opened.
+        '''
+        text = open('another_test_text.txt', 'w')
+        text.write('окно мыла')
+        text.close()
+        indexer = ToIndex('database')
+        indexer.index_by_line('another_test_text.txt')
+        indexer.close()
+        self.search_eng.reload()
+        self.assertEqual(['another_test_text.txt', 'test_text.txt'],
+                         sorted(self.search_eng.search('мыла')))
+        os.remove('another_test_text.txt')
+
+    def test_close(self):
+        '''
+        Test that the engine can be closed more than once and a read-only
+        engine can search the database.
+        '''
+        self.search_eng.close()
+        self.search_eng.close()
+        read_only_eng = SearchEngine('database', read_only=True)
+        self.assertEqual({'test_text.txt': [PositionByLine(5, 9, 0)]}, read_only_eng.search('мыла'))
+        read_only_eng.close()
+
 class TestMultiSearchEngine(unittest.TestCase):
     
     def setUp(self):
@@ -95,7 +122,7 @@ class TestMultiSearchEngine(unittest.TestCase):
         
         indexer.index_by_line('test_text.txt')
         indexer.index_by_line('another_test_text.txt')
-        del indexer
+        indexer.close()
         
         self.search_eng = SearchEngine('database')
     
@@ -159,6 +186,249 @@ class TestMultiSearchEngine(unittest.TestCase):
         ref_dict = {'test_text.txt': [PositionByLine(20, 23, 0), PositionByLine(24, 31, 0)]}
         self.assertEqual(ref_dict, search_res)
         
+    def test_positions_are_merged_in_order(self):
+        '''
+        Test that the positions of different words are sorted by line and start
+        and that a repeated word doesn't repeat its positions.
+        '''
+        search_res = self.search_eng.multi_search('не не Ах')
+        ref_dict = {'test_text.txt': [PositionByLine(0, 2, 0), PositionByLine(4, 6, 0), PositionByLine(62, 64, 0)],
+                    'another_test_text.txt': [PositionByLine(3, 5, 0), PositionByLine(22, 24, 0), PositionByLine(34, 36, 0)]}
+        self.assertEqual(ref_dict, search_res)
+
+    def test_limited_search_pages(self):
+        '''
+        Test that only the files of the required page are returned.
+        '''
+        search_res = self.search_eng.limited_multi_search('не Ах', 1, 1, ranked=False)
+        ref_dict = {'test_text.txt': [PositionByLine(0, 2, 0), PositionByLine(4, 6, 0), PositionByLine(62, 64, 0)]}
+        self.assertEqual(ref_dict, search_res)
+        self.assertEqual({}, self.search_eng.limited_multi_search('не Ах crocodile', 1, 0))
+        self.assertEqual(['another_test_text.txt', 'test_text.txt'],
+                         list(self.search_eng.limited_multi_search('не Ах', 5, 0, ranked=False)))
+
+    def test_ranked_search(self):
+        '''
+        Test that the files with more occurrences of the rarer words come first
+        and that the pages of the ranked files follow one another.
+        '''
+        texts = {'rank1.txt': 'мама мыла раму и мама мыла окно, а папа спал',
+                 'rank2.txt': 'мама папа папа папа',
+                 'rank3.txt': 'мама мыла',
+                 'rank4.txt': 'мама'}
+        indexer = ToIndex('database')
+        for file_name, text in texts.items():
+            text_file = open(file_name, 'w')
+            text_file.write(text)
+            text_file.close()
+            indexer.index_by_line(file_name)
+        indexer.close()
+        self.search_eng.reload()
+        self.assertEqual(list(self.search_eng.limited_multi_search('мама папа', 5, 0)), ['rank2.txt', 'rank1.txt'])
+        self.assertEqual(list(self.search_eng.limited_multi_search('мама мыла', 5, 0)), ['rank3.txt', 'rank1.txt'])
+        ranked = list(self.search_eng.limited_multi_search('мама', 5, 0))
+        self.assertEqual(sorted(ranked), sorted(texts))
+        self.assertEqual(ranked[0], 'rank4.txt')
+        pages = [list(self.search_eng.limited_multi_search('мама', 2, offset)) for offset in (0, 2)]
+        self.assertEqual(pages[0] + pages[1], ranked)
+        for file_name in texts:
+            os.remove(file_name)
+
+    def test_word_lengths_is_searched(self):
+        '''
+        Test that the word 'lengths' is searched like any other word
+        and doesn't get the numbers of words of the files kept for ranking.
+        '''
+        text_file = open('test_text1.txt', 'w')
+        text_file.write('the lengths of the lines')
+        text_file.close()
+        indexer = ToIndex('database')
+        indexer.index_by_line('test_text1.txt')
+        indexer.close()
+        self.search_eng.reload()
+        self.assertEqual(list(self.search_eng.limited_multi_search('lengths', 5, 0)), ['test_text1.txt'])
+        self.assertEqual(list(self.search_eng.limited_multi_search('Ах', 5, 0)),
+                         ['test_text.txt', 'another_test_text.txt'])
+        self.assertEqual(list(self.search_eng.limited_multi_search('lengths', 5, 0)), ['test_text1.txt'])
+
+    def test_files_are_matched_by_bitmaps(self):
+        '''
+        Test that the files are found by the bitmaps and that the positions
+        are not read if no file contains all the words.
+        '''
+        self.assertEqual(self.search_eng.match_all(['не', 'Ах']), 0b11)
+        self.assertEqual(self.search_eng.match_all(['не', 'про']), 0b01)
+        self.assertEqual(self.search_eng.match_all(['не', 'crocodile']), 0)
+        read_words = []
+        get_word_postings = self.search_eng.get_word_postings
+        def counting_get_word_postings(words):
+            words = list(words)
+            read_words.extend(words)
+            return get_word_postings(words)
+        self.search_eng.get_word_postings = counting_get_word_postings
+        self.assertEqual(self.search_eng.limited_multi_search('про нас', 5, 0), {})
+        self.assertEqual(read_words, [])
+        self.assertEqual(list(self.search_eng.limited_multi_search('про не', 5, 0)), ['test_text.txt'])
+        self.assertEqual(sorted(read_words), ['не', 'про'])
+
+    def test_pages_are_served_from_cache(self):
+        '''
+        Test that the next page of the same query is taken from the cache
+        and that the cache is cleared when the database is changed.
+        '''
+        first_page = self.search_eng.limited_multi_search('не Ах', 1, 0, ranked=False)
+        second_page = self.search_eng.limited_multi_search('Ах не', 1, 1, ranked=False)
+        self.assertEqual(['another_test_text.txt'], list(first_page))
+        self.assertEqual(['test_text.txt'], list(second_page))
+        self.assertEqual(self.search_eng.cache.hits, 1)
+        self.assertEqual(self.search_eng.cache.misses, 1)
+        indexer = ToIndex('database')
+        indexer.index_by_line('test_text1.txt')
+        indexer.close()
+        self.assertEqual(len(self.search_eng.cache), 0)
+
+    def test_phrase_and_near_search(self):
+        '''
+        Test that a phrase is found only where its words follow one another
+        and that NEAR/k finds the words at most k words apart.
+        '''
+        text = open('test_text.txt', 'w')
+        text.write('князь андрей и князь василий\nандрей князь\nкнязь сказал андрей')
+        text.close()
+        indexer = ToIndex('database')
+        indexer.index_by_line('test_text.txt')
+        indexer.close()
+        self.search_eng.reload()
+        self.assertEqual(self.search_eng.multi_search('"князь андрей"'),
+                         {'test_text.txt': [PositionByLine(0, 12, 0)]})
+        self.assertEqual(self.search_eng.multi_search('"андрей князь"'),
+                         {'test_text.txt': [PositionByLine(0, 12, 1)]})
+        self.assertEqual(self.search_eng.multi_search('"князь и андрей"'), {})
+        self.assertEqual(self.search_eng.multi_search('князь NEAR/1 андрей'),
+                         {'test_text.txt': [PositionByLine(0, 12, 0), PositionByLine(0, 12, 1)]})
+        self.assertEqual(self.search_eng.multi_search('князь NEAR/2 андрей'),
+                         {'test_text.txt': [PositionByLine(0, 12, 0), PositionByLine(0, 12, 1),
+                                            PositionByLine(0, 19, 2)]})
+        self.assertEqual(self.search_eng.limited_multi_search('"князь андрей"', 1, 0),
+                         {'test_text.txt': [PositionByLine(0, 12, 0)]})
+        # The simple query still gives all the positions.
+        self.assertEqual(len(self.search_eng.multi_search('князь андрей')['test_text.txt']), 7)
+        # A phrase in a boolean query gives only the places where it is found.
+        self.assertEqual(self.search_eng.multi_search('"князь андрей" OR пьер'),
+                         {'test_text.txt': [PositionByLine(0, 12, 0)]})
+        self.assertEqual(self.search_eng.multi_search('"князь андрей" AND сказал'),
+                         {'test_text.txt': [PositionByLine(0, 12, 0), PositionByLine(6, 12, 2)]})
+
+    def test_boolean_search(self):
+        '''
+        Test that the files are found by a query with AND, OR, NOT and parentheses,
+        that a word that is not in the database doesn't fail OR and that
+        the positions are not read if no file matches the query.
+        '''
+        self.assertEqual(self.search_eng.multi_search('про OR нас'),
+                         {'test_text.txt': [PositionByLine(20, 23, 0)],
+                          'another_test_text.txt': [PositionByLine(89, 92, 0)]})
+        self.assertEqual(self.search_eng.multi_search('Ах NOT про'),
+                         {'another_test_text.txt': [PositionByLine(3, 5, 0)]})
+        self.assertEqual(list(self.search_eng.multi_search('(про OR нас) AND Ах')),
+                         ['test_text.txt', 'another_test_text.txt'])
+        self.assertEqual(self.search_eng.multi_search('crocodile OR нас'),
+                         {'another_test_text.txt': [PositionByLine(89, 92, 0)]})
+        self.assertEqual(list(self.search_eng.multi_search('"Ах Австрия" NOT про')),
+                         ['another_test_text.txt'])
+        self.assertEqual(self.search_eng.multi_search('NOT Ах'), {})
+        self.assertEqual(self.search_eng.limited_multi_search('не NOT (про OR нас)', 5, 0), {})
+        read_words = []
+        get_word_postings = self.search_eng.get_word_postings
+        def counting_get_word_postings(words, required=True):
+            words = list(words)
+            read_words.extend(words)
+            return get_word_postings(words, required)
+        self.search_eng.get_word_postings = counting_get_word_postings
+        self.assertEqual(self.search_eng.limited_multi_search('crocodile AND (не OR Ах)', 5, 0), {})
+        self.assertEqual(read_words, [])
+
+    def test_wrong_boolean_query_is_a_simple_one(self):
+        '''
+        Test that a query that can't be parsed as a boolean one
+        is searched as a simple query.
+        '''
+        self.assertEqual(list(self.search_eng.multi_search('не (Ах')),
+                         ['test_text.txt', 'another_test_text.txt'])
+        self.assertEqual(list(self.search_eng.limited_multi_search('Ах) не', 5, 0)),
+                         ['test_text.txt', 'another_test_text.txt'])
+        self.assertEqual(self.search_eng.multi_search('(не OR Ах'), {})
+        self.assertEqual(list(self.search_eng.multi_search('*Австрию')), ['test_text.txt'])
+
+    def test_phrase_is_checked_in_the_files_left(self):
+        '''
+        Test that the positions of a phrase are checked only in the files
+        left by the other operands of AND.
+        '''
+        checked = []
+        match_phrase = self.search_eng.match_phrase
+        def counting_match_phrase(words, candidates):
+            checked.append(candidates)
+            return match_phrase(words, candidates)
+        self.search_eng.match_phrase = counting_match_phrase
+        self.assertEqual(list(self.search_eng.multi_search('"Ах не" AND про')), ['test_text.txt'])
+        self.assertEqual(checked, [0b01])
+
+    def test_bitmaps_are_read_once(self):
+        '''
+        Test that every bitmap is read once while a boolean query is evaluated.
+        '''
+        read_words = []
+        get_bitmap = self.search_eng.get_bitmap
+        def counting_get_bitmap(word):
+            read_words.append(word)
+            return get_bitmap(word)
+        self.search_eng.get_bitmap = counting_get_bitmap
+        self.assertEqual(list(self.search_eng.multi_search('"Ах не" AND (про OR нас) NOT crocodile')),
+                         ['test_text.txt'])
+        self.assertEqual(sorted(read_words), ['crocodile', 'Ах', 'нас', 'не', 'про'])
+
+    def test_wildcard_search(self):
+        '''
+        Test that a pattern is replaced by the words of the database that match it,
+        at most by 'limit' of them, and that such a query finds the files of all the words.
+        '''
+        self.assertEqual(self.search_eng.expand('Австри*'), ['Австрию', 'Австрия'])
+        self.assertEqual(self.search_eng.expand('Австри?'), ['Австрию', 'Австрия'])
+        self.assertEqual(self.search_eng.expand('Ав*ю'), ['Австрию'])
+        self.assertEqual(self.search_eng.expand('хо*'), ['хотела', 'хочет'])
+        self.assertEqual(self.search_eng.expand('хо*', 1), ['хотела'])
+        self.assertEqual(self.search_eng.expand('crocodile*'), [])
+        self.assertEqual(self.search_eng.multi_search('Австри*'),
+                         {'test_text.txt': [PositionByLine(24, 31, 0)],
+                          'another_test_text.txt': [PositionByLine(6, 13, 0)]})
+        self.assertEqual(list(self.search_eng.multi_search('Австр?я NOT про')), ['another_test_text.txt'])
+        self.assertEqual(self.search_eng.multi_search('не crocodile*'), {})
+        with self.assertRaises(TypeError):
+            self.search_eng.expand(12)
+        # Only MAX_SCANNED words of the dictionary are checked.
+        with mock.patch('search_engine.MAX_SCANNED', 1):
+            self.assertEqual(self.search_eng.expand('хо*'), ['хотела'])
+        # The patterns that would check the whole dictionary are not allowed.
+        for pattern in ['*ия', '?встрия', 'А*']:
+            with self.assertRaises(ValueError):
+                self.search_eng.expand(pattern)
+
+    def test_question_is_not_a_pattern(self):
+        '''
+        Test that a question mark at the end of a query is not a wildcard.
+        '''
+        text = open('test_text.txt', 'w')
+        text.write('Кто виноват в этом?')
+        text.close()
+        indexer = ToIndex('database')
+        indexer.index_by_line('test_text.txt')
+        indexer.close()
+        self.search_eng.reload()
+        self.assertEqual(list(self.search_eng.multi_search('Кто виноват?')), ['test_text.txt'])
+        self.assertEqual(list(self.search_eng.multi_search('виноват? OR crocodile')), ['test_text.txt'])
+        self.assertEqual(list(self.search_eng.multi_search('вин*?')), ['test_text.txt'])
+
     def test_if_wrong_input(self):
         '''
         Test that the programs runs okay if the input is of the wrong type.
@@ -1,9 +1,29 @@
 import unittest
 import shelve
+import pickle
 import os
 from indexation import ToIndex
 from indexation import Position
 from indexation import PositionByLine
+from indexation import PostingList
+from indexation import DocumentTable
+from indexation import TermDictionary
+from indexation import iterate_bits
+from indexation import index_file_by_line
+from indexation import map_in_order
+from concurrent.futures import ThreadPoolExecutor
+
+def with_names(db):
+    """
+    This function replaces the ids of the files in the database 'database'
+    with their names.
+    """
+    docs = DocumentTable('database')
+    result = {}
+    for word, files in db.items():
+        result[word] = dict((docs.get_name(doc_id), positions) for doc_id, positions in files.items())
+    docs.close()
+    return result
 
 class TestToIndex(unittest.TestCase):
 
@@ -19,7 +39,7 @@ class TestToIndex(unittest.TestCase):
         """
         In this method we delete the indexer and destroy the database.
         """
-        del self.indexer
+        self.indexer.close()
         files = os.listdir()
 
         for single_file in files:
@@ -97,7 +117,7 @@ class TestToIndex(unittest.TestCase):
                     }
         
         self.assertEqual(len(db), 3)
-        self.assertEqual(ref_dict, dict(db))
+        self.assertEqual(ref_dict, with_names(db))
         os.remove("test_text.txt")
         
 
@@ -116,7 +136,7 @@ class TestToIndex(unittest.TestCase):
                     }
         
         self.assertEqual(len(db), 3)
-        self.assertEqual(ref_dict, dict(db))
+        self.assertEqual(ref_dict, with_names(db))
         os.remove("test_text.txt")
 
 
@@ -141,7 +161,7 @@ class TestToIndex(unittest.TestCase):
                     'ramu': {'test_text.txt': [Position(10,14)]}
                     }
         
-        self.assertEqual(ref_dict, dict(db))
+        self.assertEqual(ref_dict, with_names(db))
         os.remove("test_text.txt")
         os.remove("another_test_text.txt")
         
@@ -159,7 +179,7 @@ class TestToIndexByString(unittest.TestCase):
         """
         In this method we delete the indexer and destroy the database.
         """
-        del self.indexer
+        self.indexer.close()
         files = os.listdir()
 
         for single_file in files:
@@ -223,7 +243,7 @@ class TestToIndexByString(unittest.TestCase):
                     'ramu': {'test_text.txt': [PositionByLine(10,14,0)]}
                     }
         
-        self.assertEqual(ref_dict, dict(db))
+        self.assertEqual(ref_dict, with_names(db))
         os.remove("test_text.txt")
         os.remove("another_test_text.txt")
 
@@ -245,6 +265,413 @@ class TestToIndexByString(unittest.TestCase):
                     }
 
         os.remove("test_text.txt")
+
+    def test_line_offsets_are_recorded(self):
+        """
+        Test that the byte offsets of the lines are recorded.
+        """
+        text_file = open('test_text.txt', 'w')
+        text_file.write('mama мыла ramu\n')
+        text_file.write('da\n')
+        text_file.write('net')
+        text_file.close()
+        self.indexer.index_by_line('test_text.txt')
+        lines = shelve.open('database.lines')
+        self.assertEqual(list(lines['test_text.txt']), [0, 19, 22, 25])
+        lines.close()
+        os.remove("test_text.txt")
                     
+    def test_bulk_index_spills_runs(self):
+        """
+        Test that bulk indexing gives the same database as indexing
+        the files one by one, even if every file is spilled to the disk.
+        """
+        text_file = open('test_text.txt', 'w')
+        text_file.write('mama мыла ramu\nda mama')
+        text_file.close()
+        another_text_file = open("another_test_text.txt", 'w')
+        another_text_file.write('mama\n\nnet')
+        another_text_file.close()
+        self.indexer.bulk_index(['test_text.txt', 'another_test_text.txt'], memory_limit=1)
+        db = shelve.open('database')
+        ref_dict = {'mama': {'test_text.txt': [PositionByLine(0,4,0), PositionByLine(3,7,1)],
+                             'another_test_text.txt': [PositionByLine(0,4,0)]},
+                    'мыла': {'test_text.txt': [PositionByLine(5,9,0)]},
+                    'ramu': {'test_text.txt': [PositionByLine(10,14,0)]},
+                    'da': {'test_text.txt': [PositionByLine(0,2,1)]},
+                    'net': {'another_test_text.txt': [PositionByLine(0,3,2)]}
+                    }
+        self.assertEqual(ref_dict, with_names(db))
+        db.close()
+        os.remove("test_text.txt")
+        os.remove("another_test_text.txt")
+
+    def test_bulk_index_wrong_input(self):
+        """
+        Test that bulk indexing checks the names of the files.
+        """
+        with self.assertRaises(TypeError):
+            self.indexer.bulk_index('test_text.txt')
+        with self.assertRaises(ValueError):
+            self.indexer.bulk_index(['nofile.txt'])
+
+    def test_failed_bulk_index_records_no_files(self):
+        """
+        Test that if a file can't be indexed, the files before it are not
+        recorded as indexed and are indexed when the bulk indexing is repeated.
+        """
+        text_file = open('test_text.txt', 'w')
+        text_file.write('mama')
+        text_file.close()
+        another_text_file = open('another_test_text.txt', 'wb')
+        another_text_file.write(b'\xff\xfe mama')
+        another_text_file.close()
+        with self.assertRaises(UnicodeDecodeError):
+            self.indexer.bulk_index(['test_text.txt', 'another_test_text.txt'])
+        self.assertNotIn('test_text.txt', self.indexer.files)
+        another_text_file = open('another_test_text.txt', 'w')
+        another_text_file.write('da')
+        another_text_file.close()
+        self.indexer.bulk_index(['test_text.txt', 'another_test_text.txt'])
+        self.assertEqual(list(with_names(self.indexer.db)['mama']), ['test_text.txt'])
+        self.assertIn('test_text.txt', self.indexer.files)
+        os.remove("test_text.txt")
+        os.remove("another_test_text.txt")
+
+    def test_index_many_in_parallel(self):
+        """
+        Test that indexing files in several processes gives the same database
+        as indexing them one by one.
+        """
+        file_names = []
+        for i in range(3):
+            file_name = 'test_text%s.txt' % i
+            text_file = open(file_name, 'w')
+            text_file.write('mama мыла ramu %s\nda mama' % i)
+            text_file.close()
+            file_names.append(file_name)
+        self.indexer.index_many(file_names, workers=2)
+        self.indexer.close()
+        db = shelve.open('database')
+        parallel_dict = dict(db)
+        db.close()
+        for single_file in os.listdir():
+            if single_file == "database" or single_file.startswith('database.'):
+                os.remove(single_file)
+        self.indexer = ToIndex('database')
+        for file_name in file_names:
+            self.indexer.index_by_line(file_name)
+        db = shelve.open('database')
+        self.assertEqual(dict(db), parallel_dict)
+        self.assertEqual(len(parallel_dict['mama']), 3)
+        db.close()
+        for file_name in file_names:
+            os.remove(file_name)
+
+    def test_map_in_order_limits_the_tasks(self):
+        """
+        Test that the results are given in the order of the items and that
+        no more than 'limit' items are submitted before their results are taken.
+        """
+        submitted = []
+        class CountingExecutor(ThreadPoolExecutor):
+            def submit(self, function, item):
+                submitted.append(item)
+                return super().submit(function, item)
+        with CountingExecutor(max_workers=2) as executor:
+            for taken, result in enumerate(map_in_order(executor, abs, range(10), 3)):
+                self.assertEqual(result, taken)
+                self.assertLessEqual(len(submitted) - taken, 3)
+        self.assertEqual(submitted, list(range(10)))
+
+    def test_indexing_same_file_twice(self):
+        """
+        Test that the positions of a file that was not changed are not duplicated.
+        """
+        text_file = open('test_text.txt', 'w')
+        text_file.write('mama мыла ramu')
+        text_file.close()
+        self.indexer.index_by_line('test_text.txt')
+        self.indexer.index_by_line('test_text.txt')
+        os.utime('test_text.txt')
+        self.indexer.bulk_index(['test_text.txt'])
+        db = shelve.open('database')
+        self.assertEqual({'test_text.txt': [PositionByLine(0,4,0)]}, with_names(db)['mama'])
+        db.close()
+        os.remove("test_text.txt")
+
+    def test_changed_file_is_indexed_again(self):
+        """
+        Test that the old positions of a changed file are replaced by new ones.
+        """
+        text_file = open('test_text.txt', 'w')
+        text_file.write('mama мыла ramu')
+        text_file.close()
+        another_text_file = open("another_test_text.txt", 'w')
+        another_text_file.write('mama')
+        another_text_file.close()
+        self.indexer.index_by_line('test_text.txt')
+        self.indexer.index_by_line('another_test_text.txt')
+        text_file = open('test_text.txt', 'w')
+        text_file.write('da\nmama')
+        text_file.close()
+        self.indexer.index_by_line('test_text.txt')
+        db = shelve.open('database')
+        ref_dict = {'mama': {'another_test_text.txt': [PositionByLine(0,4,0)],
+                             'test_text.txt': [PositionByLine(0,4,1)]},
+                    'da': {'test_text.txt': [PositionByLine(0,2,0)]}
+                    }
+        self.assertEqual(ref_dict, with_names(db))
+        db.close()
+        os.remove("test_text.txt")
+        os.remove("another_test_text.txt")
+
+    def test_file_changed_while_read_is_indexed_again(self):
+        """
+        Test that the size and the time recorded for a file are the ones
+        it had before it was read, so a change made while it was read is noticed.
+        """
+        text_file = open('test_text.txt', 'w')
+        text_file.write('mama')
+        text_file.close()
+        postings, offsets, content, sentences = index_file_by_line('test_text.txt')
+        text_file = open('test_text.txt', 'w')
+        text_file.write('mama mama da')
+        text_file.close()
+        self.indexer.record_file('test_text.txt', *self.indexer.describe_file(postings, content))
+        self.assertTrue(self.indexer.is_changed('test_text.txt'))
+        self.assertEqual(self.indexer.get_changed_files(['test_text.txt', 'test_text.txt']), ['test_text.txt'])
+        os.remove('test_text.txt')
+
+    def test_files_get_ids(self):
+        """
+        Test that the database stores the ids of the files, that the ids
+        are given in the order of indexing and don't change when a file is indexed again.
+        """
+        for file_name, text in (('test_text.txt', 'mama'), ('another_test_text.txt', 'mama da')):
+            text_file = open(file_name, 'w')
+            text_file.write(text)
+            text_file.close()
+            self.indexer.index_by_line(file_name)
+        text_file = open('test_text.txt', 'w')
+        text_file.write('mama mama')
+        text_file.close()
+        self.indexer.index_by_line('test_text.txt')
+        db = shelve.open('database')
+        self.assertEqual(sorted(db['mama']), [0, 1])
+        self.assertEqual(list(db['da']), [1])
+        db.close()
+        self.assertEqual(self.indexer.docs.get_name(0), 'test_text.txt')
+        self.assertEqual(self.indexer.docs.find_id('another_test_text.txt'), 1)
+        self.assertIsNone(self.indexer.docs.find_id('nofile.txt'))
+        self.assertEqual(len(self.indexer.docs), 2)
+        os.remove("test_text.txt")
+        os.remove("another_test_text.txt")
+
+    def test_bitmaps_follow_the_files(self):
+        """
+        Test that the bitmap of a word has the bits of the files it is in,
+        that a removed file loses its bit and that the bitmaps of an old database are built.
+        """
+        for file_name, text in (('test_text.txt', 'mama'), ('another_test_text.txt', 'mama da')):
+            text_file = open(file_name, 'w')
+            text_file.write(text)
+            text_file.close()
+            self.indexer.index_by_line(file_name)
+        self.assertEqual(self.indexer.bitmaps['mama'], 0b11)
+        self.assertEqual(self.indexer.bitmaps['da'], 0b10)
+        self.indexer.remove_file('another_test_text.txt')
+        self.assertEqual(self.indexer.bitmaps['mama'], 0b01)
+        self.assertNotIn('da', self.indexer.bitmaps)
+        self.indexer.index_by_line('another_test_text.txt')
+        self.indexer.close()
+        for single_file in os.listdir():
+            if single_file.startswith('database.bitmaps'):
+                os.remove(single_file)
+        self.indexer = ToIndex('database')
+        self.assertEqual(dict(self.indexer.bitmaps), {'mama': 0b11, 'da': 0b10})
+        self.assertEqual(list(iterate_bits(0b101001)), [0, 3, 5])
+        os.remove("test_text.txt")
+        os.remove("another_test_text.txt")
+
+    def test_term_dictionary_follows_the_words(self):
+        """
+        Test that the dictionary has the sorted words of the database, that
+        the words of a removed file are deleted from it, that the words are
+        found by a prefix and that the dictionary of an old database is built.
+        """
+        for file_name, text in (('test_text.txt', 'мама мыла раму'), ('another_test_text.txt', 'мама мыло da')):
+            text_file = open(file_name, 'w')
+            text_file.write(text)
+            text_file.close()
+            self.indexer.index_by_line(file_name)
+        # The dictionary is not written after every file.
+        self.assertEqual(len(TermDictionary('database')), 0)
+        self.indexer.save_terms()
+        terms = TermDictionary('database')
+        self.assertEqual(list(terms), ['da', 'мама', 'мыла', 'мыло', 'раму'])
+        self.assertEqual(list(terms.iterate_prefix('мы')), ['мыла', 'мыло'])
+        self.assertEqual(list(terms.iterate_prefix('мыт')), [])
+        self.assertEqual(terms[1], 'мама')
+        terms.close()
+        self.indexer.remove_file('another_test_text.txt')
+        self.indexer.save_terms()
+        terms = TermDictionary('database')
+        self.assertEqual(list(terms), ['мама', 'мыла', 'раму'])
+        terms.close()
+        self.indexer.close()
+        os.remove('database.terms')
+        self.indexer = ToIndex('database')
+        terms = TermDictionary('database')
+        self.assertEqual(list(terms), ['мама', 'мыла', 'раму'])
+        terms.close()
+        # The indexer was deleted without close(), so the dictionary
+        # is written when the database is opened again.
+        self.indexer.index_by_line('another_test_text.txt')
+        del self.indexer
+        self.assertEqual(list(TermDictionary('database')), ['мама', 'мыла', 'раму'])
+        self.indexer = ToIndex('database')
+        terms = TermDictionary('database')
+        self.assertEqual(list(terms), ['da', 'мама', 'мыла', 'мыло', 'раму'])
+        terms.close()
+        self.assertEqual(len(TermDictionary('nodatabase')), 0)
+        os.remove("test_text.txt")
+        os.remove("another_test_text.txt")
+
+    def test_file_without_record_is_merged(self):
+        """
+        Test that the positions of a file that has no record of its words
+        are merged with the positions in the database.
+        """
+        text_file = open('test_text.txt', 'w')
+        text_file.write('mama mama')
+        text_file.close()
+        self.indexer.index_by_line('test_text.txt')
+        del self.indexer.files['test_text.txt']
+        self.indexer.index_by_line('test_text.txt')
+        positions = self.indexer.db['mama'][0]
+        self.assertEqual(list(positions.with_ordinals()), [(PositionByLine(0, 4, 0), 0), (PositionByLine(5, 9, 0), 1),
+                                                           (PositionByLine(0, 4, 0), 0), (PositionByLine(5, 9, 0), 1)])
+        os.remove('test_text.txt')
+
+    def test_remove_file(self):
+        """
+        Test that all the positions of a removed file are deleted.
+        """
+        text_file = open('test_text.txt', 'w')
+        text_file.write('mama мыла ramu')
+        text_file.close()
+        another_text_file = open("another_test_text.txt", 'w')
+        another_text_file.write('mama')
+        another_text_file.close()
+        self.indexer.index_by_line('test_text.txt')
+        self.indexer.index_by_line('another_test_text.txt')
+        self.indexer.remove_file('test_text.txt')
+        db = shelve.open('database')
+        self.assertEqual({'mama': {'another_test_text.txt': [PositionByLine(0,4,0)]}}, with_names(db))
+        db.close()
+        os.remove("test_text.txt")
+        os.remove("another_test_text.txt")
+
+class TestPositions(unittest.TestCase):
+
+    def test_positions_have_no_dictionary(self):
+        """
+        Test that positions keep their attributes in slots.
+        """
+        self.assertFalse(hasattr(PositionByLine(0, 4, 0), '__dict__'))
+        self.assertFalse(hasattr(Position(0, 4), '__dict__'))
+
+    def test_positions_are_pickled(self):
+        """
+        Test that positions are pickled and compared as before.
+        """
+        position = pickle.loads(pickle.dumps(PositionByLine(5, 9, 2)))
+        self.assertEqual(position, PositionByLine(5, 9, 2))
+        self.assertEqual(repr(position), '(5, 9, 2)')
+        self.assertEqual(pickle.loads(pickle.dumps(Position(5, 9))), Position(5, 9))
+
+    def test_old_pickled_state_is_restored(self):
+        """
+        Test that a position pickled before the slots were added is restored.
+        """
+        position = PositionByLine.__new__(PositionByLine)
+        position.__setstate__({'start': 5, 'end': 9, 'line': 2})
+        self.assertEqual(position, PositionByLine(5, 9, 2))
+
+class TestPostingList(unittest.TestCase):
+
+    def test_positions_are_packed_and_unpacked(self):
+        """
+        Test that the positions are decoded in the same order as they were packed.
+        """
+        positions = [PositionByLine(0, 4, 0), PositionByLine(200, 210, 0),
+                     PositionByLine(5, 9, 3), PositionByLine(0, 1, 400), PositionByLine(3, 300, 400)]
+        posting_list = PostingList()
+        posting_list.extend(positions)
+        self.assertEqual(len(posting_list), 5)
+        self.assertEqual(list(posting_list), positions)
+        self.assertEqual(posting_list[2], PositionByLine(5, 9, 3))
+        decoded = posting_list.decoded
+        self.assertEqual(posting_list[-1], PositionByLine(3, 300, 400))
+        self.assertIs(posting_list.decoded, decoded)
+        posting_list.append(PositionByLine(7, 8, 401))
+        self.assertEqual(posting_list[-1], PositionByLine(7, 8, 401))
+
+    def test_posting_list_is_pickled(self):
+        """
+        Test that a pickled list can be unpickled and extended.
+        """
+        posting_list = PostingList()
+        posting_list.append(PositionByLine(10, 14, 2))
+        restored = pickle.loads(pickle.dumps(posting_list))
+        restored.append(PositionByLine(15, 19, 2))
+        self.assertEqual(restored, [PositionByLine(10, 14, 2), PositionByLine(15, 19, 2)])
+
+    def test_ordinals_are_packed_and_unpacked(self):
+        """
+        Test that the numbers of the words are decoded with the positions
+        and that a list without them can't be used for phrases.
+        """
+        pairs = [(PositionByLine(0, 4, 0), 0), (PositionByLine(200, 210, 0), 40),
+                 (PositionByLine(5, 9, 3), 1), (PositionByLine(3, 7, 3), 0)]
+        posting_list = PostingList(ordinals=True)
+        for position, ordinal in pairs:
+            posting_list.append(position, ordinal)
+        restored = pickle.loads(pickle.dumps(posting_list))
+        self.assertEqual(list(restored.with_ordinals()), pairs)
+        self.assertEqual(list(restored), [position for position, ordinal in pairs])
+        with self.assertRaises(ValueError):
+            posting_list.append(PositionByLine(8, 9, 3))
+        with self.assertRaises(ValueError):
+            list(PostingList().with_ordinals())
+
+    def test_extend_keeps_ordinals(self):
+        """
+        Test that a list extended with another one keeps the numbers of the words
+        and that it stops storing them if the new positions don't have them.
+        """
+        first = PostingList(ordinals=True)
+        first.append(PositionByLine(0, 4, 0), 0)
+        second = PostingList(ordinals=True)
+        second.append(PositionByLine(5, 9, 0), 1)
+        second.append(PositionByLine(3, 7, 2), 0)
+        first.extend(second)
+        self.assertEqual(list(first.with_ordinals()), [(PositionByLine(0, 4, 0), 0), (PositionByLine(5, 9, 0), 1),
+                                                       (PositionByLine(3, 7, 2), 0)])
+        first.extend([PositionByLine(8, 9, 2)])
+        self.assertFalse(first.ordinals)
+        self.assertEqual(list(first), [PositionByLine(0, 4, 0), PositionByLine(5, 9, 0),
+                                       PositionByLine(3, 7, 2), PositionByLine(8, 9, 2)])
+
+    def test_posting_list_is_smaller_than_pickled_positions(self):
+        """
+        Test that the packed positions take less space than pickled objects.
+        """
+        positions = [PositionByLine(i % 80, i % 80 + 5, i // 10) for i in range(1000)]
+        posting_list = PostingList()
+        posting_list.extend(positions)
+        self.assertLess(len(pickle.dumps(posting_list)) * 5, len(pickle.dumps(positions)))
+
 if __name__ == '__main__':
     unittest.main()
@@ -291,5 +291,71 @@ class TestTokenizeWithTypes(unittest.TestCase):
         self.assertEqual(tokens[2].tp, 'p')       
          
 
+class TestTokenizeReduced(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Create an object of the class ToTokenize.
+        """
+        self.token= ToTokenize()
+
+    def reference(self, stream):
+        """
+        Alphabetical and digital tokens found by tokenize_with_types().
+        """
+        return [(token.start, token.wordform, token.tp)
+                for token in self.token.tokenize_with_types(stream)
+                if token.tp == 'a' or token.tp == 'd']
+
+    def check(self, stream):
+        """
+        Check that tokenize_reduced() gives the same tokens as tokenize_with_types().
+        """
+        tokens=[(token.start, token.wordform, token.tp)
+                for token in self.token.tokenize_reduced(stream)]
+        self.assertEqual(tokens, self.reference(stream))
+
+    def test_input_type_is_a_number(self):
+        """
+        Test that if the input is an integer than TypeError is raised.
+        """
+        with self.assertRaises(TypeError):
+            list(self.token.tokenize_reduced(42))
+
+    def test_input_is_an_empty_string(self):
+        """
+        Test that if the input is an empty string than there are no tokens.
+        """
+        self.assertEqual(list(self.token.tokenize_reduced("")), [])
+
+    def test_same_tokens_as_tokenize_with_types(self):
+        """
+        Test that the tokens are the same as alphabetical and digital tokens
+        of tokenize_with_types().
+        """
+        self.check("name 'self' is not defined")
+        self.check(" name 'self' is not defined!")
+        self.check("E123tokeni   zation.py78655a")
+        self.check("ooh la la мама мыла раму123  frf34")
+        self.check("Ах, не говорите мне про Австрию!")
+        self.check("snake_case 2½ ²x ١٢٣ été")
+
+    def test_tokens_have_no_dictionary(self):
+        """
+        Test that tokens keep their attributes in slots.
+        """
+        tokens=list(self.token.tokenize_reduced("мама мыла"))
+        self.assertFalse(hasattr(tokens[0], '__dict__'))
+        self.assertEqual(repr(tokens[0]), "a, 'мама'")
+
+    def test_token_offsets(self):
+        """
+        Test the starts and types of the tokens of a mixed string.
+        """
+        tokens=list(self.token.tokenize_reduced("ab12 cd"))
+        self.assertEqual([token.start for token in tokens], [0, 2, 5])
+        self.assertEqual([token.wordform for token in tokens], ['ab', '12', 'cd'])
+        self.assertEqual([token.tp for token in tokens], ['a', 'd', 'a'])
+
 if __name__ == '__main__':
     unittest.main()
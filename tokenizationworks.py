@@ -4,6 +4,23 @@ It consists of two classes: class Token and class ToTokenize.
 """
 import unicodedata
 import shelve
+import re
+
+# '\w' matches every character for which isalpha() or isdigit() is true,
+# and also other numeric characters and '_'. So every alphabetical or digital
+# token lies inside one run of this pattern.
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def restore_state(obj, state):
+    """
+    This function restores a pickled object that keeps its attributes in slots.
+    Objects pickled before their class got slots have a dictionary as their state.
+    """
+    if isinstance(state, tuple):
+        state = state[1]
+    for name, value in state.items():
+        setattr(obj, name, value)
 
 
 class Token:
@@ -13,6 +30,7 @@ class Token:
     'start' which is an index of the first character of a wordform,
     and 'wordform' which is the wordform.
     """
+    __slots__ = ('wordform', 'start')
 
     def __init__(self, s, wordform):
         """
@@ -31,7 +49,14 @@ class Token:
         """
         return self.wordform
 
+    def __setstate__(self, state):
+        """
+        This method restores a pickled token.
+        """
+        restore_state(self, state)
+
 class TokenWithType(Token):
+    __slots__ = ('tp',)
 
     def __init__(self, s, wordform, tp):
 
@@ -258,12 +283,31 @@ class ToTokenize:
     def tokenize_reduced(self, stream):
         """"
         This method is used to return only alphabetic and digital characters.
+        It gives the same tokens as tokenize_with_types() without spaces,
+        punctuation and other characters, but it doesn't check
+        the type of every character.
         @param: a string
         @return: a token
         """
-        for token in (self.tokenize_with_types(stream)):
-            if token.tp == 'a' or token.tp == 'd':
-                yield token
+        # Raise TypeError if the input type is not string
+        if not isinstance(stream, str):
+            raise(TypeError)
+
+        # Find the runs of word characters with the precompiled pattern.
+        for match in WORD_PATTERN.finditer(stream):
+            run = match.group()
+            start = match.start()
+            # Usually a run consists of letters only or of digits only.
+            if run.isalpha():
+                yield TokenWithType(start, run, 'a')
+            elif run.isdigit():
+                yield TokenWithType(start, run, 'd')
+            # Otherwise it is something like 'раму123' or 'a_b',
+            # and we have to look at the type of each character.
+            else:
+                for token in self.tokenize_with_types(run):
+                    if token.tp == 'a' or token.tp == 'd':
+                        yield TokenWithType(start + token.start, token.wordform, token.tp)
 
 
             
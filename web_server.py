@@ -3,8 +3,15 @@ import cgi
 from context_windows import ContextWindow
 from context_windows import Contexter
 from search_engine import SearchEngine
+import query_cache
+from query_cache import LRUCache
+from document_store import DocumentStore
 from indexation import PositionByLine
 import time
+import signal
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 class RequestHandler(BaseHTTPRequestHandler):
     '''
@@ -80,7 +87,6 @@ class RequestHandler(BaseHTTPRequestHandler):
                 cw_offset = 1
             # Add to the list.    
             limofpairs.append((cw_offset, cw_limit))
-        print(limofpairs, 'limofpairs')
         # Send response to the browser that the requested page was found.
         self.send_response(200)        
         # Establish that the content must be interpreted as
@@ -102,65 +108,167 @@ class RequestHandler(BaseHTTPRequestHandler):
                                 <br>
                                 <label for = "docoffset"> docoffset
                                 <input type = 'text' name = 'docoffset' 'value = '%s'>'''% (query, doclimit, docoffset), encoding = "utf-8"))                  
-        # Create a search engine.
-        search_engine = SearchEngine('database')        
-        # Search user's query and write them to 'search_results'.
-        search_results = search_engine.limited_multi_search(query, doclimit, docoffset)
+        # Search user's query with the search engine shared by all the requests
+        # and write them to 'search_results'.
+        search_results = self.server.search_engine.limited_multi_search(query, doclimit, docoffset)
         # If search_results is empty, send message to a user
         # and raise an exception.
         if search_results == {}:
             self.wfile.write(bytes('Your query is not in the database', encoding = "utf-8"))
             raise ValueError
-        # If the docoffset is bigger than the number of documents, 
-        # make the latter the doclimit.
-        if docoffset > len(search_results):
-            docoffset = len(search_results) - 1      
-        # Create an object of the 'Contexter' class to get context windows.
-        self.contexter = Contexter()
-        # Get context windows and make the query words bold.
-        cws = self.contexter.get_bold_cws_limited(search_results, 5, doclimit, docoffset, limofpairs)
-        # Put the volumes of "War and Peace" in chronological order.
-        sorted_file_names = sorted(cws)
+        # Get context windows and make the query words bold. The documents
+        # are already limited by the search engine, so the offset of the page
+        # is 0, and only the quotes required for each document are made.
+        # The offsets of the quotes in the form start from 1.
+        pairs = [(offset - 1, limit) for offset, limit in limofpairs]
+        cws = self.server.contexter.get_bold_cws_limited(search_results, 5, doclimit, 0, pairs, query)
+        # The volumes of "War and Peace" are in the order of their rank.
+        sorted_file_names = list(cws)
         # Send tags to indicate the beginning of the html body of the page
         # and start an ordered list.
         self.wfile.write(bytes('''<html><body><form><ol>''', encoding = "utf-8"))
         # Iterating through the file names.
         for i, fn in enumerate(sorted_file_names):
-            # Exit the cycle if 'i' is out of limit.
-            if i >= docoffset + doclimit: 
-                break
-            if i >= docoffset:
-                limofpair = limofpairs[i]
-                print(limofpair, 'pair')
-                # Post each file name as an element of an ordered list.
-                self.wfile.write(bytes('<li><p>%s</p></i>' % fn, encoding = "utf-8"))
-                # Create slots for limits and offsets for each specific document.
-                self.wfile.write(bytes("""
-                                        <label for = "cw%soffset"> offset
-                                        <input type = "text" name = "cw%soffset"  value = "%s">
-                                        <label for = "cw%slimit"> limit
-                                        <input type = "text" name = "cw%slimit"  value = "%s" >
-                                        """% (i, i, limofpair[0], i, i, limofpair[1]), encoding="utf-8"))
-                # Send the tag to indicate the beginning of the unordered list.
-                self.wfile.write(bytes('<ul>', encoding = "utf-8"))
-                for t, cw in enumerate(cws[fn]):
-                    print(cws[fn], 'cws')
-                    print(t, 't')
-                    print((limofpair[0] - 1) + limofpair[1], 'sum')
-                    print(limofpair[0] - 1, 'offset')
-                    if t >= ((limofpair[0] - 1) + limofpair[1]):
-                        break
-                    if t >= (limofpair[0] - 1):
-                        print(t, 't')
-                        print((limofpair[0] - 1) + limofpair[1])
-                        # Post each quote from the file as an element of an unordered list.
-                        self.wfile.write(bytes('<li><p>%s</p></i>' % cw, encoding = "utf-8"))
-                self.wfile.write(bytes('</ul>', encoding = "utf-8"))
+            limofpair = limofpairs[i]
+            # Post each file name as an element of an ordered list.
+            self.wfile.write(bytes('<li><p>%s</p></i>' % fn, encoding = "utf-8"))
+            # Create slots for limits and offsets for each specific document.
+            self.wfile.write(bytes("""
+                                    <label for = "cw%soffset"> offset
+                                    <input type = "text" name = "cw%soffset"  value = "%s">
+                                    <label for = "cw%slimit"> limit
+                                    <input type = "text" name = "cw%slimit"  value = "%s" >
+                                    """% (i, i, limofpair[0], i, i, limofpair[1]), encoding="utf-8"))
+            # Send the tag to indicate the beginning of the unordered list.
+            self.wfile.write(bytes('<ul>', encoding = "utf-8"))
+            for cw in cws[fn]:
+                # Post each quote from the file as an element of an unordered list.
+                self.wfile.write(bytes('<li><p>%s</p></i>' % cw, encoding = "utf-8"))
+            self.wfile.write(bytes('</ul>', encoding = "utf-8"))
         # Send tags to mark the end of the html body.
         self.wfile.write(bytes('</ol></form></body></html>', encoding = "utf-8"))
         # Print the time. 
         print('time: ', time.time() - start_time)
           
+class ThreadPoolMixIn:
+    '''
+    This class makes a server handle each request in a pool of threads,
+    so that a slow query doesn't block the other users.
+    The accept loop only hands the requests over to the pool.
+    '''
+
+    def start_pool(self, workers):
+        '''
+        This method creates the pool of threads.
+        @param 'workers': the number of threads.
+        '''
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        '''
+        This method passes a request to the pool.
+        '''
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        '''
+        This method handles a request in a thread of the pool.
+        '''
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def stop_pool(self):
+        '''
+        This method waits for the requests being handled and stops the pool.
+        '''
+        self.executor.shutdown(wait=True)
+
+class SearchServer(ThreadPoolMixIn, HTTPServer):
+    '''
+    This class creates a server that opens the database once, when it starts,
+    and shares the search engine and the contexter between all the requests.
+    The requests are handled by a pool of threads.
+    '''
+
+    def __init__(self, server_address, handler_class, db_name='database', workers=8,
+                 snippet_cache_size=64 * 1024 * 1024, snippet_ttl=600, open_now=True):
+        '''
+        Create the server and open the database.
+        @param 'server_address': a pair of a host and a port.
+        @param 'handler_class': the class that handles the requests.
+        @param 'db_name': the name of the database.
+        @param 'workers': the number of threads that handle the requests.
+        @param 'snippet_cache_size': the approximate number of bytes the bold quotes can take.
+        @param 'snippet_ttl': the number of seconds a bold quote is kept.
+        @param 'open_now': if it is False, only the socket is created, and
+        the database is opened by open() later, for example after a fork.
+        '''
+        HTTPServer.__init__(self, server_address, handler_class)
+        self.db_name = db_name
+        self.workers = workers
+        self.snippet_cache_size = snippet_cache_size
+        self.snippet_ttl = snippet_ttl
+        self.search_engine = None
+        if open_now:
+            self.open()
+
+    def open(self):
+        '''
+        This method opens the database and starts the pool of threads.
+        Each process has to call it itself, so that the processes don't share
+        the files of the database and the threads.
+        '''
+        self.search_engine = SearchEngine(self.db_name, read_only=True)
+        self.snippet_cache = LRUCache(self.snippet_cache_size, self.snippet_ttl)
+        query_cache.register(self.db_name, self.snippet_cache)
+        self.contexter = Contexter(DocumentStore(self.db_name), self.snippet_cache)
+        self.start_pool(self.workers)
+
+    def reload(self):
+        '''
+        This method reopens the database after it was changed by ToIndex.
+        ToIndex usually runs in another process, so the caches of this
+        process are not cleared by it and are cleared here.
+        '''
+        self.search_engine.reload()
+        self.contexter.store.reload()
+        self.snippet_cache.clear()
+
+    def server_close(self):
+        '''
+        This method stops the server and closes the database.
+        '''
+        HTTPServer.server_close(self)
+        if self.search_engine is not None:
+            self.stop_pool()
+            self.search_engine.close()
+          
 if __name__ == '__main__':       
-    server = HTTPServer(('', 80), RequestHandler)
-    server.serve_forever()
+    parser = argparse.ArgumentParser(description='Web search engine.')
+    parser.add_argument('--port', type=int, default=80)
+    parser.add_argument('--db', default='database', help='the name of the database')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='the number of threads in each process')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='the number of processes sharing the socket (needs fork)')
+    args = parser.parse_args()
+    server = SearchServer(('', args.port), RequestHandler, args.db, args.workers, open_now=False)
+    # Fork the processes after the socket is created, so they all accept
+    # connections from it. Each of them opens the database and starts
+    # its own pool of threads after the fork.
+    if args.processes > 1 and hasattr(os, 'fork'):
+        for i in range(args.processes - 1):
+            if os.fork() == 0:
+                break
+    server.open()
+    # Reopen the database when the index is rebuilt: kill -HUP <pid>
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: server.reload())
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()